@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock
+
+from cobot import voice_bot
+from cobot.autocomplete import SoundIndex, depunctuate
+from cobot.browser import PageCache, chunk_strings_into
+
+SOUND_DIR = os.path.join(os.path.dirname(__file__), '..', 'sounds')
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+CATALOG_SIZES = (200, 2000, 20000)
+QUERIES = ('bat', 'dead elephant', 'hardg', 'xyzzy', 'greatmission')
+
+
+def real_names():
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(SOUND_DIR)
+                  if f.endswith('.ogg'))
+
+
+# Real names padded out with variations of themselves, so trigram overlap
+# looks like a real library rather than random noise.
+def synthetic_names(n, seed=0):
+    rng = random.Random(seed)
+    base = real_names()
+    names = list(base[:n])
+    while len(names) < n:
+        a, b = rng.choice(base), rng.choice(base)
+        names.append(f"{a}-{b.split('-')[0]}-{len(names)}")
+    return names
+
+
+def timeit(fn, min_time=0.2, repeat=5):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def bench_pure(results, sizes, loop):
+    for n in sizes:
+        names = synthetic_names(n)
+        sounds = {depunctuate(s): s for s in names}
+
+        results[f"depunctuate[{n}]"] = timeit(
+            lambda: [depunctuate(s) for s in names])
+        results[f"chunk_strings_into[{n}]"] = timeit(
+            lambda: chunk_strings_into(sorted(sounds.values()), 1900))
+        pages = PageCache()
+        pages.get(0, sounds.values())
+        results[f"list_pages_cached[{n}]"] = timeit(
+            lambda: pages.get(0, sounds.values()))
+        results[f"get_fuzzy_match_scores[{n}]"] = timeit(
+            lambda: [voice_bot.get_fuzzy_match_scores(q, sounds)
+                     for q in QUERIES],
+            repeat=3)
+        results[f"catalog_build[{n}]"] = timeit(
+            lambda: voice_bot.set_catalog(names))
+
+        # Uncached autocomplete: a fresh query string every call.
+        voice_bot.set_catalog(names)
+        interaction = MagicMock(guild_id=1)
+        counter = iter(range(10**9))
+
+        def autocomplete():
+            for q in QUERIES:
+                loop.run_until_complete(voice_bot.sound_name_autocomplete(
+                    interaction, f"{q}{next(counter)}"))
+
+        results[f"sound_name_autocomplete[{n}]"] = timeit(autocomplete,
+                                                          repeat=3)
+        index = SoundIndex(sounds)
+        results[f"sound_index_top_cached[{n}]"] = timeit(
+            lambda: [index.top(q, 20) for q in QUERIES])
+
+
+def bench_r128(results, seconds=(1, 5, 30)):
+    import numpy as np
+    from cobot import r128
+    rng = np.random.default_rng(0)
+    for n in seconds:
+        pcm = rng.uniform(-0.1, 0.1, (n * r128.RATE, 2)).astype(np.float32)
+        results[f"r128_analyze[{n}s]"] = timeit(lambda: r128.analyze(pcm),
+                                                repeat=3)
+
+
+def bench_ffmpeg(results, loop, clips=5):
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found, skipping download/analyze benchmarks",
+              file=sys.stderr)
+        return
+    names = real_names()[:clips]
+
+    async def cold():
+        for name in names:
+            path = await voice_bot.audio_source.download(name)
+            voice_bot.filter_settings(await voice_bot.get_volume(path))
+
+    async def warm():
+        for name in names:
+            path = await voice_bot.audio_source.download(name)
+            await voice_bot.get_audio_filter(path)
+
+    results[f"download_get_volume_filter[{clips}]"] = timeit(
+        lambda: loop.run_until_complete(cold()), min_time=0, repeat=3)
+    loop.run_until_complete(warm())
+    results[f"download_cached_filter[{clips}]"] = timeit(
+        lambda: loop.run_until_complete(warm()))
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'benchmark':<40}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40}{'-':>12}{now * 1000:>10.3f}ms{'new':>8}")
+            continue
+        ratio = now / before
+        flag = " !" if ratio > threshold else ""
+        print(f"{name:<40}{before * 1000:>10.3f}ms{now * 1000:>10.3f}ms"
+              f"{ratio:>7.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks for the bot's hot paths. "
+        "No Discord or S3 needed; ffmpeg benchmarks need ffmpeg on PATH.")
+    parser.add_argument("--save", metavar="NAME",
+                        help="Save results as a named baseline")
+    parser.add_argument("--compare", metavar="NAME",
+                        help="Compare results against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression")
+    parser.add_argument("--no-ffmpeg", action="store_true",
+                        help="Skip the download/get_volume benchmarks")
+    parser.add_argument("--sizes",
+                        type=lambda s: [int(n) for n in s.split(',')],
+                        default=CATALOG_SIZES,
+                        help="Comma separated synthetic catalog sizes")
+    parser.add_argument("-k", metavar="SUBSTRING",
+                        help="Only report benchmarks whose name contains this")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {}
+    loop = asyncio.new_event_loop()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        voice_bot.init([
+            '--mock-audio', '--audio-dir', SOUND_DIR, '--cache-dir', cache_dir,
+            '--no-cached-catalog', '--no-prefetch'
+        ])
+        bench_pure(results, args.sizes, loop)
+        bench_r128(results)
+        if not args.no_ffmpeg:
+            bench_ffmpeg(results, loop)
+    loop.close()
+    if args.k:
+        results = {k: v for k, v in results.items() if args.k in k}
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+    else:
+        for name, seconds in results.items():
+            print(f"{name:<40}{seconds * 1000:>10.3f}ms")
+        regressions = []
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save}.json"), "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if regressions:
+        sys.exit(f"{len(regressions)} benchmark(s) regressed: "
+                 f"{', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
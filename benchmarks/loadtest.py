@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock
+
+import discord
+
+from cobot import voice_bot
+from cobot.audio_source import CachedAudioSource, LocalAudioSource
+from cobot.metrics import Histogram
+
+SOUND_DIR = os.path.join(os.path.dirname(__file__), '..', 'sounds')
+FRAME_SECONDS = 0.02
+OPERATIONS = ('play', 'autocomplete', 'list', 'join')
+
+
+# LocalAudioSource that pretends to be remote, so sounds go through the
+# download cache with some simulated S3 latency.
+class SlowLocalSource(LocalAudioSource):
+
+    def __init__(self, audio_dir, latency):
+        super().__init__(audio_dir)
+        self.latency = latency
+
+    def local_path(self, sound_name):
+        return None
+
+    async def list_objects(self):
+        await asyncio.sleep(self.latency)
+        return await super().list_objects()
+
+    async def fetch(self, sound_name, dest_path, etag=None):
+        await asyncio.sleep(self.latency)
+        return await super().fetch(sound_name, dest_path, etag)
+
+
+# Stands in for discord.VoiceClient. Like discord.py's AudioPlayer, a thread
+# pulls a frame from the source every 20ms; frames are counted and late
+# reads (the audio would have stuttered) recorded.
+class FakeVoiceClient(discord.VoiceClient):
+
+    def __init__(self, stats, channel):
+        self.stats = stats
+        self.channel = channel
+        self._connected = True
+        self._playing = None
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._playing is not None and self._playing.is_alive()
+
+    def play(self, source, *, after=None, **kwargs):
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+        stop = threading.Event()
+        thread = threading.Thread(target=self._run,
+                                  args=(source, after, stop),
+                                  daemon=True)
+        thread.stop_event = stop
+        self._playing = thread
+        thread.start()
+
+    def _run(self, source, after, stop):
+        next_frame = time.perf_counter()
+        error = None
+        try:
+            while not stop.is_set():
+                if not source.read():
+                    break
+                self.stats.frames += 1
+                next_frame += FRAME_SECONDS
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -FRAME_SECONDS:
+                    self.stats.late_frames += 1
+                    next_frame = time.perf_counter()
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+        if after is not None:
+            after(error)
+
+    def stop(self):
+        if self._playing is not None:
+            self._playing.stop_event.set()
+        self._playing = None
+
+    async def move_to(self, channel, **kwargs):
+        await asyncio.sleep(self.stats.connect_latency / 2)
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+
+
+class FakeChannel:
+
+    def __init__(self, guild, channel_id, stats):
+        self.guild = guild
+        self.id = channel_id
+        self.name = f"voice-{channel_id}"
+        self.stats = stats
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.stats.connect_latency)
+        self.guild.voice_client = FakeVoiceClient(self.stats, self)
+        return self.guild.voice_client
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id, stats, channels=2):
+        self.id = guild_id
+        self.voice_client = None
+        self.voice_channels = [
+            FakeChannel(self, guild_id * 100 + i, stats)
+            for i in range(channels)
+        ]
+
+
+class FakeResponse:
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.done_at = None
+
+    def is_done(self):
+        return self.done_at is not None
+
+    async def _respond(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.done_at = time.perf_counter()
+
+    defer = send_message = edit_message = send_modal = _respond
+
+
+class FakeFollowup:
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = []
+
+    async def send(self, content, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.messages.append(content)
+
+
+def fake_interaction(guild, api_latency):
+    interaction = MagicMock()
+    interaction.guild = guild
+    interaction.guild_id = guild.id
+    interaction.user = MagicMock(spec=discord.Member)
+    interaction.user.voice.channel = guild.voice_channels[0]
+    interaction.response = FakeResponse(api_latency)
+    interaction.followup = FakeFollowup(api_latency)
+    return interaction
+
+
+class LoadStats:
+
+    def __init__(self, connect_latency):
+        self.connect_latency = connect_latency
+        self.latency = {op: Histogram(window=1 << 20) for op in OPERATIONS}
+        self.errors = {op: 0 for op in OPERATIONS}
+        self.loop_lag = Histogram(window=1 << 20)
+        self.frames = 0
+        self.late_frames = 0
+
+
+async def measure_loop_lag(stats, interval=0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.observe(time.perf_counter() - start - interval)
+
+
+def autocomplete_query(rng, names):
+    name = rng.choice(names)
+    typed = name[:rng.randint(2, max(2, len(name)))]
+    # A stray character now and then, so not every keystroke is a cache hit.
+    if rng.random() < 0.3:
+        typed += rng.choice('abcdefghijklmnopqrstuvwxyz')
+    return typed
+
+
+async def run_operation(op, guild, stats, rng, names, api_latency):
+    interaction = fake_interaction(guild, api_latency)
+    start = time.perf_counter()
+    try:
+        if op == 'play':
+            await voice_bot.play.callback(interaction, rng.choice(names))
+            if any(m.startswith('Error') for m in interaction.followup.messages):
+                raise RuntimeError(interaction.followup.messages[-1])
+        elif op == 'autocomplete':
+            await voice_bot.sound_name_autocomplete(
+                interaction, autocomplete_query(rng, names))
+        elif op == 'list':
+            await voice_bot.list_sounds.callback(interaction)
+        elif op == 'join':
+            channel = rng.choice(guild.voice_channels)
+            await voice_bot.join.callback(interaction, str(channel.id))
+    except Exception:
+        stats.errors[op] += 1
+        return
+    stats.latency[op].observe(time.perf_counter() - start)
+
+
+# Poisson arrivals at `rate` requests per second, each for a random guild
+# and an operation picked by `weights`.
+async def generate_load(stats, guilds, rate, duration, weights, rng, names,
+                        api_latency):
+    ops, op_weights = zip(*weights.items())
+    tasks = set()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(rng.expovariate(rate))
+        op = rng.choices(ops, op_weights)[0]
+        task = asyncio.create_task(
+            run_operation(op, rng.choice(guilds), stats, rng, names,
+                          api_latency))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+def report(stats, elapsed):
+    lines = [
+        f"{'operation':<14}{'n':>7}{'err':>6}{'req/s':>8}{'p50':>9}"
+        f"{'p99':>9}{'max':>9}"
+    ]
+    for op in OPERATIONS:
+        h = stats.latency[op]
+        if not h.count and not stats.errors[op]:
+            continue
+        q = h.quantiles()
+        worst = max(h.samples, default=0.0)
+        lines.append(f"{op:<14}{h.count:>7}{stats.errors[op]:>6}"
+                     f"{h.count / elapsed:>8.1f}{q[0.5] * 1000:>7.0f}ms"
+                     f"{q[0.99] * 1000:>7.0f}ms{worst * 1000:>7.0f}ms")
+    lag = stats.loop_lag.quantiles()
+    lines.append(f"event loop lag: p50 {lag[0.5] * 1000:.1f}ms, "
+                 f"p99 {lag[0.99] * 1000:.1f}ms, "
+                 f"max {max(stats.loop_lag.samples, default=0) * 1000:.1f}ms")
+    lines.append(f"audio frames: {stats.frames} sent, "
+                 f"{stats.late_frames} late")
+    first = voice_bot.metrics.stages.get('first_packet')
+    if first is not None:
+        q = first.quantiles()
+        lines.append(f"/play to first frame: p50 {q[0.5] * 1000:.0f}ms, "
+                     f"p99 {q[0.99] * 1000:.0f}ms")
+    return "\n".join(lines)
+
+
+async def run(args, bot_args):
+    voice_bot.init(bot_args)
+    if args.remote_latency_ms is not None:
+        voice_bot.audio_source = CachedAudioSource(
+            SlowLocalSource(args.audio_dir, args.remote_latency_ms / 1000),
+            os.path.join(voice_bot.args.cache_dir, "audio"),
+            max_bytes=voice_bot.args.audio_cache_mb * 1024 * 1024)
+    await voice_bot.load_catalog()
+    names = sorted(voice_bot.sounds.values())
+    if not names:
+        sys.exit(f"No sounds found in {args.audio_dir}")
+
+    stats = LoadStats(args.connect_ms / 1000)
+    guilds = [FakeGuild(i + 1, stats) for i in range(args.guilds)]
+    rng = random.Random(args.seed)
+    weights = dict(zip(OPERATIONS, args.mix))
+    lag_monitor = asyncio.create_task(measure_loop_lag(stats))
+    start = time.perf_counter()
+    try:
+        await generate_load(stats, guilds, args.rate, args.duration, weights,
+                            rng, names, args.api_ms / 1000)
+        elapsed = time.perf_counter() - start
+    finally:
+        lag_monitor.cancel()
+        for guild in guilds:
+            if guild.voice_client is not None:
+                await guild.voice_client.disconnect()
+        voice_bot.prefetcher.cancel_all()
+    return report(stats, elapsed)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Drive the bot's slash command handlers with simulated "
+        "guilds. Needs ffmpeg on PATH, no Discord or network.")
+    parser.add_argument("--guilds", type=int, default=20,
+                        help="Simulated guilds")
+    parser.add_argument("--rate", type=float, default=20.0,
+                        help="Requests per second across all guilds")
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="Seconds to generate load for")
+    parser.add_argument(
+        "--mix",
+        type=lambda s: [float(w) for w in s.split(',')],
+        default=[0.3, 0.6, 0.05, 0.05],
+        help="Relative weights of play,autocomplete,list,join")
+    parser.add_argument("--audio-dir", default=SOUND_DIR,
+                        help="Sounds to play")
+    parser.add_argument(
+        "--remote-latency-ms",
+        type=float,
+        help="Serve sounds through the download cache as if remote, with "
+        "this much added latency per request")
+    parser.add_argument("--connect-ms", type=float, default=300.0,
+                        help="Simulated voice handshake time")
+    parser.add_argument("--api-ms", type=float, default=50.0,
+                        help="Simulated Discord API round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    # Anything else is passed through to the bot, e.g. --playback mix.
+    return parser.parse_known_args()
+
+
+def main():
+    args, extra = parse_args()
+    if len(args.mix) != len(OPERATIONS):
+        sys.exit(f"--mix needs {len(OPERATIONS)} weights")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bot_args = [
+            '--mock-audio', '--audio-dir', args.audio_dir, '--cache-dir',
+            cache_dir, '--no-cached-catalog'
+        ] + extra
+        print(asyncio.run(run(args, bot_args)))
+
+
+if __name__ == '__main__':
+    main()
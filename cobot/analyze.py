@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from cobot.audio_source import (MANIFEST_NAME, LocalAudioSource,
+                                S3AudioSource)
+from cobot.loudness import file_digest, measure_file
+
+log = logging.getLogger('sqcobot.analyze')
+
+MANIFEST_VERSION = 1
+
+
+def analyze_file(path, analyzer="ffmpeg"):
+    if analyzer == "numpy":
+        from cobot.r128 import measure_file as measure
+    else:
+        measure = measure_file
+    loudness, duration = measure(path)
+    return {
+        "sha256": file_digest(path),
+        "size": os.path.getsize(path),
+        "duration": duration,
+        "loudness": loudness,
+    }
+
+
+async def fetch_all(audio_source, names, dest_dir):
+    async def fetch(name):
+        return (audio_source.local_path(name)
+                or await audio_source.download(name, dest_dir))
+
+    return await asyncio.gather(*(fetch(name) for name in names))
+
+
+def build_manifest(audio_source, jobs=None, analyzer="ffmpeg"):
+    names = sorted(asyncio.run(audio_source.list_sounds()))
+    with tempfile.TemporaryDirectory(prefix="cobot_analyze_") as tmpdir:
+        paths = asyncio.run(fetch_all(audio_source, names, tmpdir))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = pool.map(analyze_file,
+                               paths,
+                               [analyzer] * len(paths),
+                               chunksize=4)
+            sounds = dict(zip(names, results))
+    return {"version": MANIFEST_VERSION, "sounds": sounds}
+
+
+def write_manifest(manifest, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(
+            f"Unsupported manifest version {manifest.get('version')}")
+    return manifest
+
+
+async def load_source_manifest(audio_source, dest_dir):
+    try:
+        path = await audio_source.download_manifest(dest_dir)
+        if path is None:
+            return None
+        return load_manifest(path)
+    except Exception:
+        log.exception("Failed to load sound manifest")
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure every sound once and write a manifest for the bot")
+    parser.add_argument("--audio-dir",
+                        type=str,
+                        help="Analyze a local directory instead of S3")
+    parser.add_argument("--bucket",
+                        type=str,
+                        default=os.environ.get('AUDIO_BUCKET'),
+                        help="S3 bucket to analyze (default: $AUDIO_BUCKET)")
+    parser.add_argument("--output",
+                        type=str,
+                        help="Manifest path (default: <audio-dir>/"
+                        f"{MANIFEST_NAME}, or ./{MANIFEST_NAME} for S3)")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Worker processes")
+    parser.add_argument("--analyzer",
+                        choices=["numpy", "ffmpeg"],
+                        default="numpy",
+                        help="Loudness measurement, see voice_bot --analyzer")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    args = parse_args()
+    if args.audio_dir:
+        audio_source = LocalAudioSource(audio_dir=args.audio_dir)
+        output = args.output or os.path.join(args.audio_dir, MANIFEST_NAME)
+    elif args.bucket:
+        audio_source = S3AudioSource(bucket_name=args.bucket)
+        output = args.output or MANIFEST_NAME
+    else:
+        raise SystemExit("Need --audio-dir or --bucket/$AUDIO_BUCKET")
+
+    manifest = build_manifest(audio_source,
+                              jobs=args.jobs,
+                              analyzer=args.analyzer)
+    write_manifest(manifest, output)
+    log.info(f"Wrote {len(manifest['sounds'])} sounds to {output}")
+
+
+if __name__ == '__main__':
+    main()
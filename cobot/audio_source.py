@@ -1,24 +1,82 @@
+import asyncio
+import functools
+import json
+import logging
 import os
-import boto3
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from cobot.blobstore import write_atomic
+from cobot.filelock import FileLock
+
+log = logging.getLogger('sqcobot.audio')
+
+# Written next to the sounds by `python -m cobot.analyze`.
+MANIFEST_NAME = "manifest.json"
+
+
+class NotModified(Exception):
+    pass
+
+
+def sound_name_of(key):
+    return os.path.splitext(os.path.basename(key))[0]
 
 
 class AudioSource:
 
-    def list_sounds(self):
+    # S3-shaped dicts (Key, ETag, LastModified, Size) for every .ogg.
+    async def list_objects(self):
         raise NotImplementedError
 
+    async def list_sounds(self):
+        return [sound_name_of(obj['Key']) for obj in await self.list_objects()]
+
     async def download(self, sound_name, dest_dir):
         raise NotImplementedError
 
+    async def download_manifest(self, dest_dir):
+        raise NotImplementedError
+
+    # Write the sound to dest_path and return its ETag, or raise NotModified
+    # if it still matches the given one.
+    async def fetch(self, sound_name, dest_path, etag=None):
+        raise NotImplementedError
+
+    # A stable path that can be read in place, if the sound is already on a
+    # local (or shared) filesystem. Remote backends return None and are
+    # copied through the cache instead.
+    def local_path(self, sound_name):
+        return None
+
 
 class LocalAudioSource(AudioSource):
 
     def __init__(self, audio_dir="sounds"):
         self.audio_dir = audio_dir
 
-    def list_sounds(self):
-        files = [f for f in os.listdir(self.audio_dir) if f.endswith('.ogg')]
-        return [os.path.splitext(f)[0] for f in files]
+    def _etag(self, st):
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    async def list_objects(self):
+        objects = []
+        for f in os.listdir(self.audio_dir):
+            if not f.endswith('.ogg'):
+                continue
+            st = os.stat(os.path.join(self.audio_dir, f))
+            objects.append({
+                'Key': f,
+                'ETag': self._etag(st),
+                'LastModified': st.st_mtime,
+                'Size': st.st_size,
+            })
+        return objects
 
     async def download(self, sound_name, dest_dir):
         fname = f"{sound_name}.ogg"
@@ -30,23 +88,247 @@ class LocalAudioSource(AudioSource):
             dst.write(src.read())
         return dest_path
 
+    async def download_manifest(self, dest_dir):
+        path = os.path.join(self.audio_dir, MANIFEST_NAME)
+        return path if os.path.exists(path) else None
+
+    def local_path(self, sound_name):
+        path = os.path.join(self.audio_dir, f"{sound_name}.ogg")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Local file not found: {path}")
+        return path
+
+    async def fetch(self, sound_name, dest_path, etag=None):
+        src_path = os.path.join(self.audio_dir, f"{sound_name}.ogg")
+        if not os.path.exists(src_path):
+            raise FileNotFoundError(f"Local file not found: {src_path}")
+        current = self._etag(os.stat(src_path))
+        if current == etag:
+            raise NotModified(sound_name)
+        shutil.copyfile(src_path, dest_path)
+        return current
+
 
+# boto3 is synchronous, so every call runs on a dedicated thread pool sized
+# to the client's connection pool and never blocks the event loop. The client
+# (and boto3 itself, which is slow to import) is created on first use.
 class S3AudioSource(AudioSource):
 
-    def __init__(self, bucket_name):
-        self.s3 = boto3.client('s3')
+    def __init__(self, bucket_name, max_connections=10):
         self.bucket = bucket_name
+        self.max_connections = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=max_connections,
+                                           thread_name_prefix="cobot-s3")
+        self._s3 = None
+        self._s3_lock = threading.Lock()
+
+    @property
+    def s3(self):
+        # boto3's default session isn't safe to build clients from in parallel.
+        with self._s3_lock:
+            if self._s3 is None:
+                import boto3
+                from botocore.config import Config
+                self._s3 = boto3.client(
+                    's3',
+                    config=Config(max_pool_connections=self.max_connections))
+        return self._s3
 
-    def list_sounds(self):
-        response = self.s3.list_objects_v2(Bucket=self.bucket)
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs))
+
+    # A client method, looked up on the worker so the first call builds the
+    # client there rather than on the event loop.
+    async def _call(self, method, *args, **kwargs):
+        return await self._run(
+            lambda: getattr(self.s3, method)(*args, **kwargs))
+
+    def _list_objects(self):
+        paginator = self.s3.get_paginator('list_objects_v2')
         return [
-            os.path.splitext(os.path.basename(obj['Key']))[0]
-            for obj in response.get('Contents', [])
+            obj for page in paginator.paginate(Bucket=self.bucket)
+            for obj in page.get('Contents', [])
             if obj['Key'].endswith('.ogg')
         ]
 
+    async def list_objects(self):
+        return await self._run(self._list_objects)
+
     async def download(self, sound_name, dest_dir):
         fname = f"{sound_name}.ogg"
         dest_path = os.path.join(dest_dir, fname)
-        self.s3.download_file(self.bucket, fname, dest_path)
+        await self._call('download_file', self.bucket, fname, dest_path)
         return dest_path
+
+    async def download_manifest(self, dest_dir):
+        dest_path = os.path.join(dest_dir, MANIFEST_NAME)
+        try:
+            await self._call('download_file', self.bucket, MANIFEST_NAME,
+                             dest_path)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return dest_path
+
+    def _fetch(self, sound_name, dest_path, etag):
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = self.s3.get_object(Bucket=self.bucket,
+                                          Key=f"{sound_name}.ogg",
+                                          **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                raise NotModified(sound_name)
+            raise
+        with open(dest_path, "wb") as dst:
+            shutil.copyfileobj(response['Body'], dst)
+        return response['ETag']
+
+    async def fetch(self, sound_name, dest_path, etag=None):
+        return await self._run(self._fetch, sound_name, dest_path, etag)
+
+
+# Keeps fetched sounds on local disk within a byte budget, evicting the least
+# recently played first. Entries younger than max_age are served without
+# asking the backend; older ones are revalidated with their ETag so unchanged
+# sounds are never downloaded twice.
+class CachedAudioSource(AudioSource):
+
+    INDEX_NAME = "index.json"
+
+    def __init__(self, source, cache_dir, max_bytes, max_age=300):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @property
+    def total_bytes(self):
+        return sum(e["size"] for e in self.entries.values())
+
+    async def list_objects(self):
+        return await self.source.list_objects()
+
+    async def download_manifest(self, dest_dir=None):
+        return await self.source.download_manifest(dest_dir or self.cache_dir)
+
+    def path_for(self, sound_name):
+        return os.path.join(self.cache_dir, f"{sound_name}.ogg")
+
+    def local_path(self, sound_name):
+        return self.source.local_path(sound_name)
+
+    # dest_dir is accepted for compatibility; files always live in the cache,
+    # or where they already are for local sources.
+    async def download(self, sound_name, dest_dir=None):
+        local = self.source.local_path(sound_name)
+        if local is not None:
+            return local
+        path = self.path_for(sound_name)
+        entry = self.entries.get(sound_name)
+        if entry is None:
+            # Possibly fetched by another process sharing the directory.
+            index = await asyncio.to_thread(self._read_index)
+            entry = index.get(sound_name)
+        if entry is not None and not os.path.exists(path):
+            self.entries.pop(sound_name, None)
+            entry = None
+        if entry is not None and time.time() - entry["validated"] < self.max_age:
+            self.entries[sound_name] = entry
+            self.entries.move_to_end(sound_name)
+            return path
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fetch_")
+        os.close(fd)
+        try:
+            etag = await self.source.fetch(sound_name, tmp_path,
+                                           entry["etag"] if entry else None)
+            os.replace(tmp_path, path)
+            entry = {"etag": etag, "size": os.path.getsize(path)}
+            log.info(f"Fetched {sound_name} into audio cache")
+        except NotModified:
+            log.debug(f"{sound_name} unchanged since last fetch")
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        entry["validated"] = time.time()
+        self.entries[sound_name] = entry
+        self.entries.move_to_end(sound_name)
+        self._evict()
+        await self._save_index()
+        return path
+
+    async def discard(self, *sound_names):
+        dropped = [n for n in sound_names
+                   if self.entries.pop(n, None) is not None]
+        for sound_name in dropped:
+            self._remove(sound_name)
+        if dropped:
+            await self._save_index()
+
+    def _remove(self, sound_name):
+        try:
+            os.unlink(self.path_for(sound_name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = self.total_bytes
+        # Never evict the entry that was just used.
+        while total > self.max_bytes and len(self.entries) > 1:
+            sound_name, entry = self.entries.popitem(last=False)
+            self._remove(sound_name)
+            total -= entry["size"]
+            log.info(f"Evicted {sound_name} from audio cache")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_NAME)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return OrderedDict()
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            log.exception(f"Ignoring unreadable audio cache index {self.index_path}")
+            return OrderedDict()
+        return OrderedDict((sound_name, entry) for sound_name, entry in index
+                           if os.path.exists(self.path_for(sound_name)))
+
+    def _load_index(self):
+        self.entries.update(self._read_index())
+        self._evict()
+
+    # The cache directory may be shared with other bot processes: fold in
+    # whatever they fetched (as least recently used) before writing back.
+    # Only the file work runs in threads; entries are changed here, on the
+    # loop, so other coroutines never see them mid-update.
+    async def _save_index(self):
+        for sound_name, entry in (await asyncio.to_thread(self._read_index)).items():
+            ours = self.entries.get(sound_name)
+            if ours is None:
+                self.entries[sound_name] = entry
+                self.entries.move_to_end(sound_name, last=False)
+            elif entry["validated"] > ours["validated"]:
+                self.entries[sound_name] = entry
+        self._evict()
+        await asyncio.to_thread(self._write_index, list(self.entries.items()))
+
+    # Blocks on the other processes' lock. Anything they added since the
+    # read in _save_index is kept; it's merged into entries next time.
+    def _write_index(self, items):
+        with FileLock(self.index_path):
+            ours = {sound_name for sound_name, _ in items}
+            theirs = [(sound_name, entry)
+                      for sound_name, entry in self._read_index().items()
+                      if sound_name not in ours]
+            write_atomic(self.index_path, json.dumps(theirs + items).encode())
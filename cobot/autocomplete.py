@@ -0,0 +1,109 @@
+import heapq
+import re
+from collections import Counter, OrderedDict
+
+from fuzzywuzzy import fuzz
+
+
+def depunctuate(name: str):
+    return re.sub(r'[\W_]+', '', name).lower()
+
+
+def trigrams(s: str):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def prefixes(s: str):
+    return {s[:n] for n in (1, 2) if len(s) >= n}
+
+
+# Answers "best k sounds for what the user typed so far" without scoring the
+# whole library on every keystroke. Keys sharing the most trigrams with the
+# query are shortlisted, only those get fuzz.partial_ratio, and a heap picks
+# the top k. Queries too short for trigrams are answered from the keys that
+# start with them. Nothing ever scans every key, except in libraries no
+# bigger than max_candidates, which are scored in full.
+# Results are memoized per query in a small LRU since Discord sends one
+# request per keystroke and users backspace a lot.
+class SoundIndex:
+
+    def __init__(self, sounds=None, max_candidates=200, cache_size=256):
+        self.max_candidates = max_candidates
+        self.cache_size = cache_size
+        self.rebuild(sounds or {})
+
+    def rebuild(self, sounds):
+        self.keys = list(sounds)
+        self.position = {k: i for i, k in enumerate(self.keys)}
+        self.grams = {}
+        self.prefixes = {}
+        for key in self.keys:
+            self._link(key)
+        self._cache = OrderedDict()
+
+    def _link(self, key):
+        for gram in trigrams(key):
+            self.grams.setdefault(gram, []).append(key)
+        for prefix in prefixes(key):
+            self.prefixes.setdefault(prefix, []).append(key)
+
+    def add(self, key):
+        if key in self.position:
+            return
+        self.position[key] = len(self.keys)
+        self.keys.append(key)
+        self._link(key)
+        self._cache.clear()
+
+    def remove(self, key):
+        if key not in self.position:
+            return
+        self.keys.remove(key)
+        self.position = {k: i for i, k in enumerate(self.keys)}
+        for table, parts in ((self.grams, trigrams(key)),
+                             (self.prefixes, prefixes(key))):
+            for part in parts:
+                keys = table[part]
+                keys.remove(key)
+                if not keys:
+                    del table[part]
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, query):
+        if len(self.keys) <= self.max_candidates:
+            return self.keys
+        if len(query) < 3:
+            return self.prefixes.get(query, [])[:self.max_candidates]
+        overlap = Counter()
+        for gram in trigrams(query):
+            overlap.update(self.grams.get(gram, ()))
+        best = heapq.nsmallest(self.max_candidates,
+                               overlap,
+                               key=lambda k: (-overlap[k], self.position[k]))
+        return sorted(best, key=self.position.__getitem__)
+
+    def top_scored(self, name: str, k: int):
+        query = depunctuate(name)
+        cached = self._cache.get((query, k))
+        if cached is not None:
+            self._cache.move_to_end((query, k))
+            return cached
+
+        if not query:
+            result = [(key, 0) for key in self.keys[:k]]
+        else:
+            scored = ((fuzz.partial_ratio(query, key), -i, key)
+                      for i, key in enumerate(self._candidates(query)))
+            result = [(key, score)
+                      for score, _, key in heapq.nlargest(k, scored)]
+
+        self._cache[(query, k)] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def top(self, name: str, k: int):
+        return [key for key, _ in self.top_scored(name, k)]
@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+from botocore.exceptions import ClientError
+
+
+# Replaces path with data in one step, so readers see the old contents or the
+# new, never part of either. Other processes writing the same file need a
+# FileLock around this to avoid losing each other's changes.
+def write_atomic(path, data):
+    dirname = os.path.dirname(path) or "."
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname,
+                               prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+# A few bytes the bot keeps between runs, like the command fingerprint or
+# the restart snapshot. load() returns None if nothing was saved yet.
+class LocalBlobStore:
+
+    def __init__(self, path):
+        self.path = path
+
+    async def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def save(self, data):
+        write_atomic(self.path, data)
+
+
+# For tasks whose disk doesn't outlive them (Fargate), next to the sounds.
+class S3BlobStore:
+
+    def __init__(self, s3_source, key):
+        self.s3_source = s3_source
+        self.key = key
+
+    def _load(self):
+        try:
+            response = self.s3_source.s3.get_object(
+                Bucket=self.s3_source.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return response['Body'].read()
+
+    async def load(self):
+        return await self.s3_source._run(self._load)
+
+    async def save(self, data):
+        await self.s3_source._call('put_object',
+                                   Bucket=self.s3_source.bucket,
+                                   Key=self.key,
+                                   Body=data)
@@ -0,0 +1,118 @@
+import discord
+
+# Room for the code block fence and the page footer in a 2000 char message.
+PAGE_CHARS = 1800
+
+
+def chunk_strings_into(li, chunksize):
+    chunked = []
+    chunk = []
+    total = 0
+    for s in li:
+        if total + len(s) + 1 > chunksize and chunk:
+            chunked.append(chunk)
+            chunk = []
+            total = 0
+        chunk.append(s)
+        total += len(s) + 1
+    if chunk:
+        chunked.append(chunk)
+    return chunked
+
+
+def render_pages(names, max_len=PAGE_CHARS):
+    return ["```\n" + "\n".join(chunk) + "\n```"
+            for chunk in chunk_strings_into(names, max_len)]
+
+
+# Rendered /list pages for the current catalog. The sort and chunking only
+# happen again once the catalog generation moves on.
+class PageCache:
+
+    def __init__(self):
+        self.generation = None
+        self.pages = []
+
+    def get(self, generation, names):
+        if generation != self.generation:
+            self.pages = render_pages(sorted(names))
+            self.generation = generation
+        return self.pages
+
+
+class FilterModal(discord.ui.Modal, title="Filter sounds"):
+
+    query = discord.ui.TextInput(label="Sound name contains",
+                                 required=False,
+                                 max_length=100)
+
+    def __init__(self, browser):
+        super().__init__()
+        self.browser = browser
+        self.query.default = browser.query
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.browser.set_filter(self.query.value.strip())
+        await self.browser.show(interaction)
+
+
+# Ephemeral, paginated sound list. Unfiltered pages are shared with every
+# other browser; a filter renders just its matches, ranked like autocomplete
+# by search(query).
+class SoundBrowser(discord.ui.View):
+
+    def __init__(self, pages, search, timeout=300):
+        super().__init__(timeout=timeout)
+        self.all_pages = pages
+        self.search = search
+        self.pages = pages
+        self.page = 0
+        self.query = ""
+        self._update_buttons()
+
+    def set_filter(self, query):
+        self.query = query
+        if query:
+            self.pages = render_pages(self.search(query))
+        else:
+            self.pages = self.all_pages
+        self.page = 0
+        self._update_buttons()
+
+    def content(self):
+        if not self.pages:
+            return f"No sounds match `{self.query}`."
+        footer = f"Page {self.page + 1}/{len(self.pages)}"
+        if self.query:
+            footer += f" matching `{self.query}`"
+        return f"{self.pages[self.page]}\n{footer}"
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= len(self.pages) - 1
+        self.clear_filter.disabled = not self.query
+
+    async def show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(content=self.content(),
+                                                view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button):
+        self.page = max(self.page - 1, 0)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button):
+        self.page = min(self.page + 1, len(self.pages) - 1)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Filter", style=discord.ButtonStyle.primary)
+    async def filter(self, interaction: discord.Interaction, button):
+        await interaction.response.send_modal(FilterModal(self))
+
+    @discord.ui.button(label="Clear filter",
+                       style=discord.ButtonStyle.secondary)
+    async def clear_filter(self, interaction: discord.Interaction, button):
+        self.set_filter("")
+        await self.show(interaction)
@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from botocore.exceptions import ClientError
+
+from cobot.analyze import load_manifest
+from cobot.audio_source import (MANIFEST_NAME, AudioSource, NotModified,
+                                sound_name_of)
+
+log = logging.getLogger('sqcobot.bundle')
+
+# Every sound in one file, so the bot can start with a single request:
+#
+#   magic (8 bytes) | format version (u32 LE) | header length (u32 LE)
+#   header: JSON {"sounds": {name: {"offset", "size", "etag"}},
+#                 "manifest": <cobot.analyze manifest or null>}
+#   data: the .ogg files back to back; offsets are relative to its start
+MAGIC = b"COBOTBND"
+BUNDLE_VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+BUNDLE_NAME = "sounds.bundle"
+# First read when opening a bundle remotely; usually covers the whole header.
+HEADER_PROBE = 64 * 1024
+
+
+# The bundle was replaced since its index was read, so offsets from that
+# index no longer point at the right clips.
+class BundleChanged(Exception):
+    pass
+
+
+def build_bundle(audio_dir, output, manifest=None):
+    names = sorted(sound_name_of(f) for f in os.listdir(audio_dir)
+                   if f.endswith('.ogg'))
+    sounds = {}
+    offset = 0
+    for name in names:
+        with open(os.path.join(audio_dir, f"{name}.ogg"), "rb") as f:
+            data = f.read()
+        sounds[name] = {
+            "offset": offset,
+            "size": len(data),
+            "etag": hashlib.sha256(data).hexdigest(),
+        }
+        offset += len(data)
+    header = json.dumps({"sounds": sounds, "manifest": manifest},
+                        sort_keys=True).encode()
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                               prefix=".bundle_")
+    with os.fdopen(fd, "wb") as out:
+        out.write(PREAMBLE.pack(MAGIC, BUNDLE_VERSION, len(header)))
+        out.write(header)
+        for name in names:
+            with open(os.path.join(audio_dir, f"{name}.ogg"), "rb") as f:
+                out.write(f.read())
+    # mkstemp creates the file owner-only.
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, output)
+    return sounds
+
+
+def parse_preamble(data):
+    magic, version, header_len = PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a sound bundle")
+    if version != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version {version}")
+    return PREAMBLE.size + header_len
+
+
+# Reads a bundle on local disk through a memory map. version() changes when
+# the file is replaced.
+class FileBundleReader:
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._mapped_version = None
+
+    async def version(self):
+        st = os.stat(self.path)
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    async def open(self, version):
+        if self._map is None or version != self._mapped_version:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_version = version
+
+    async def read(self, start, length):
+        return self._map[start:start + length]
+
+
+# Reads a bundle from S3 through an S3AudioSource's client and thread pool.
+# whole=True downloads it once (one GET) and maps the local copy; otherwise
+# the header and each clip are fetched with ranged GETs, conditional on the
+# bundle still being the one that was opened.
+class S3BundleReader:
+
+    def __init__(self, s3_source, key, cache_dir, whole=True):
+        self.s3_source = s3_source
+        self.key = key
+        self.path = os.path.join(cache_dir, os.path.basename(key))
+        self.whole = whole
+        self.file = None
+        self._etag = None
+
+    def _head(self):
+        return self.s3_source.s3.head_object(Bucket=self.s3_source.bucket,
+                                             Key=self.key)['ETag']
+
+    async def version(self):
+        return await self.s3_source._run(self._head)
+
+    async def open(self, etag):
+        if etag == self._etag:
+            return
+        if self.whole:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            await self.s3_source._call('download_file',
+                                       self.s3_source.bucket, self.key, tmp)
+            os.replace(tmp, self.path)
+            self.file = FileBundleReader(self.path)
+            await self.file.open(await self.file.version())
+            log.info(f"Downloaded sound bundle {self.key}")
+        self._etag = etag
+
+    def _get_range(self, start, length):
+        try:
+            response = self.s3_source.s3.get_object(
+                Bucket=self.s3_source.bucket,
+                Key=self.key,
+                Range=f"bytes={start}-{start + length - 1}",
+                IfMatch=self._etag)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('412',
+                                                           'PreconditionFailed'):
+                raise BundleChanged(self.key)
+            raise
+        return response['Body'].read()
+
+    async def read(self, start, length):
+        if self.file is not None:
+            return await self.file.read(start, length)
+        return await self.s3_source._run(self._get_range, start, length)
+
+
+# AudioSource over a bundle. The index is read when first needed and again
+# whenever the bundle itself changes, which list_objects() checks, so the
+# periodic catalog refresh picks up a new bundle with a single HEAD/stat.
+class BundleAudioSource(AudioSource):
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.sounds = None
+        self.manifest = None
+        self.data_start = 0
+        self.version = None
+        self._lock = asyncio.Lock()
+
+    async def _load(self):
+        async with self._lock:
+            version = await self.reader.version()
+            if self.sounds is not None and version == self.version:
+                return
+            await self.reader.open(version)
+            probe = await self.reader.read(0, HEADER_PROBE)
+            data_start = parse_preamble(probe)
+            if data_start > len(probe):
+                probe += await self.reader.read(len(probe),
+                                                data_start - len(probe))
+            header = json.loads(probe[PREAMBLE.size:data_start])
+            self.sounds = header["sounds"]
+            self.manifest = header.get("manifest")
+            self.data_start = data_start
+            self.version = version
+            log.info(f"Loaded bundle index with {len(self.sounds)} sounds")
+
+    # The per-clip hash is the version; a rebuilt bundle only changes the
+    # clips that actually differ.
+    async def list_objects(self):
+        await self._load()
+        return [{
+            'Key': f"{name}.ogg",
+            'ETag': entry["etag"],
+            'Size': entry["size"],
+        } for name, entry in self.sounds.items()]
+
+    async def _entry(self, sound_name):
+        if self.sounds is None:
+            await self._load()
+        entry = self.sounds.get(sound_name)
+        if entry is None:
+            raise FileNotFoundError(f"{sound_name} is not in the bundle")
+        return entry
+
+    async def _read(self, sound_name):
+        entry = await self._entry(sound_name)
+        try:
+            return entry, await self.reader.read(
+                self.data_start + entry["offset"], entry["size"])
+        except BundleChanged:
+            log.info("Sound bundle was replaced, reloading its index")
+            await self._load()
+        entry = await self._entry(sound_name)
+        return entry, await self.reader.read(self.data_start + entry["offset"],
+                                             entry["size"])
+
+    async def read(self, sound_name):
+        _, data = await self._read(sound_name)
+        return data
+
+    async def _write(self, sound_name, dest_path):
+        entry, data = await self._read(sound_name)
+        await asyncio.to_thread(_write_file, dest_path, data)
+        return entry
+
+    async def download(self, sound_name, dest_dir):
+        dest_path = os.path.join(dest_dir, f"{sound_name}.ogg")
+        await self._write(sound_name, dest_path)
+        return dest_path
+
+    async def download_manifest(self, dest_dir):
+        if self.sounds is None:
+            await self._load()
+        if self.manifest is None:
+            return None
+        path = os.path.join(dest_dir, MANIFEST_NAME)
+        await asyncio.to_thread(_write_file, path,
+                                json.dumps(self.manifest).encode())
+        return path
+
+    async def fetch(self, sound_name, dest_path, etag=None):
+        entry = await self._entry(sound_name)
+        if etag is not None and etag == entry["etag"]:
+            raise NotModified(sound_name)
+        entry = await self._write(sound_name, dest_path)
+        return entry["etag"]
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pack a directory of sounds into a single bundle file")
+    parser.add_argument("--audio-dir", default="sounds",
+                        help="Directory of .ogg files")
+    parser.add_argument("--output", default=BUNDLE_NAME,
+                        help="Bundle path")
+    parser.add_argument(
+        "--manifest",
+        help="Loudness manifest to embed (default: <audio-dir>/"
+        f"{MANIFEST_NAME} if it exists)")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    args = parse_args()
+    manifest_path = args.manifest or os.path.join(args.audio_dir,
+                                                  MANIFEST_NAME)
+    manifest = None
+    if os.path.exists(manifest_path):
+        manifest = load_manifest(manifest_path)
+    elif args.manifest:
+        raise SystemExit(f"No manifest at {manifest_path}")
+    sounds = build_bundle(args.audio_dir, args.output, manifest)
+    log.info(f"Wrote {len(sounds)} sounds to {args.output}"
+             f"{' with loudness manifest' if manifest else ''}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+from cobot.audio_source import sound_name_of
+
+
+def object_versions(objects):
+    return {
+        sound_name_of(obj['Key']): (obj.get('ETag'), str(obj.get('LastModified')))
+        for obj in objects
+    }
+
+
+# What the bot last saw in the audio source, so a periodic relist can be
+# reduced to the sounds that were added, removed or replaced since.
+# generation moves on whenever the set of names does, for anything derived
+# from the name list.
+class Catalog:
+
+    def __init__(self):
+        self.versions = {}
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.versions)
+
+    # Names without version info (from a manifest or the cached catalog).
+    # They count as unchanged on the next update.
+    def reset(self, names):
+        self.versions = {name: None for name in names}
+        self.generation += 1
+
+    def update(self, versions):
+        added = [n for n in versions if n not in self.versions]
+        removed = [n for n in self.versions if n not in versions]
+        changed = [
+            n for n, version in versions.items()
+            if self.versions.get(n) is not None and self.versions[n] != version
+        ]
+        self.versions = dict(versions)
+        if added or removed:
+            self.generation += 1
+        return added, removed, changed
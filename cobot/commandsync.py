@@ -0,0 +1,40 @@
+import hashlib
+import json
+import logging
+
+log = logging.getLogger('sqcobot.commandsync')
+
+FINGERPRINT_NAME = "commands.sha256"
+
+
+# Everything Discord stores about our slash commands for one scope. If this
+# hasn't changed since the last sync there is nothing to upload.
+def tree_fingerprint(tree, application_id, guild=None):
+    commands = sorted((c.to_dict(tree) for c in tree.get_commands(guild=guild)),
+                      key=lambda c: c["name"])
+    payload = {
+        "application_id": application_id,
+        "guild": guild.id if guild is not None else None,
+        "commands": commands,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+# Returns the synced commands, or None if the fingerprint in store (a
+# blobstore) shows Discord already has this exact tree.
+async def sync_if_changed(tree, store, application_id, guild=None):
+    fingerprint = tree_fingerprint(tree, application_id, guild)
+    try:
+        stored = await store.load()
+        if stored is not None and stored.decode().strip() == fingerprint:
+            log.info("Command tree unchanged, skipping sync.")
+            return None
+    except Exception:
+        log.exception("Couldn't read command fingerprint, syncing anyway")
+    synced = await tree.sync(guild=guild)
+    try:
+        await store.save(fingerprint.encode())
+    except Exception:
+        log.exception("Couldn't save command fingerprint")
+    return synced
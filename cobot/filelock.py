@@ -0,0 +1,23 @@
+import fcntl
+import os
+
+
+# Advisory lock on a sidecar file, so several bot processes can share one
+# on-disk cache. Readers never need it since every write is an atomic rename;
+# it only serializes read-merge-write cycles.
+class FileLock:
+
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self._fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
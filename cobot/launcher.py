@@ -0,0 +1,116 @@
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+log = logging.getLogger('sqcobot.launcher')
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+def recommended_shard_count(token):
+    response = requests.get(GATEWAY_BOT_URL,
+                            headers={"Authorization": f"Bot {token}"},
+                            timeout=10)
+    response.raise_for_status()
+    return response.json()["shards"]
+
+
+def split_shards(shard_count, workers):
+    workers = max(1, min(workers, shard_count))
+    return [list(range(i, shard_count, workers)) for i in range(workers)]
+
+
+def worker_command(shard_ids, shard_count, bot_args, metrics_port=0):
+    cmd = [
+        sys.executable, "-m", "cobot.voice_bot", "--shard-count",
+        str(shard_count), "--shard-ids", ",".join(map(str, shard_ids)),
+        *bot_args
+    ]
+    if metrics_port:
+        cmd += ["--metrics-port", str(metrics_port)]
+    return cmd
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the voice bot as several sharded worker processes. "
+        "Unrecognized arguments are passed on to every worker.")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        help="Total shards (default: Discord's recommendation)")
+    parser.add_argument("--restart-delay",
+                        type=float,
+                        default=5.0,
+                        help="Seconds to wait before restarting a dead worker")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.environ.get('COBOT_METRICS_PORT', '0')),
+        help="Metrics port of the first worker; the others count up from "
+        "it (0 disables)")
+    return parser.parse_known_args()
+
+
+# Workers share --cache-dir; the loudness and audio caches lock their index
+# files, so they can all read and write it at once. Each gets its own metrics
+# port, since they'd otherwise all try to bind the same one.
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    args, bot_args = parse_args()
+    shard_count = args.shard_count or recommended_shard_count(
+        os.environ['DISCORD_TOKEN'])
+    assignments = split_shards(shard_count, args.workers)
+    log.info(f"Running {shard_count} shards across {len(assignments)} workers")
+
+    procs = {}
+    restart_at = {}
+    stopping = False
+
+    def start(i):
+        port = args.metrics_port + i if args.metrics_port else 0
+        cmd = worker_command(assignments[i], shard_count, bot_args, port)
+        procs[i] = subprocess.Popen(cmd)
+        log.info(f"Worker {i} (shards {assignments[i]}) pid={procs[i].pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(len(assignments)):
+        start(i)
+
+    while not stopping:
+        time.sleep(1)
+        for i, proc in procs.items():
+            if stopping or proc.poll() is None:
+                continue
+            if i not in restart_at:
+                log.error(f"Worker {i} exited with {proc.returncode}")
+                restart_at[i] = time.monotonic() + args.restart_delay
+            elif time.monotonic() >= restart_at[i]:
+                del restart_at[i]
+                start(i)
+
+    for proc in procs.values():
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
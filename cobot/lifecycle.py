@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger('sqcobot.lifecycle')
+
+
+# Last activity per guild, so voice connections (and everything kept per
+# guild while connected) can be released once nobody has used them for
+# idle_timeout seconds. A guild that is still busy, e.g. playing a long
+# sound, counts as active.
+class VoiceLifecycle:
+
+    def __init__(self, idle_timeout, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.last_active = {}
+
+    def __len__(self):
+        return len(self.last_active)
+
+    def touch(self, guild_id):
+        self.last_active[guild_id] = self.clock()
+
+    # Start the idle clock for a connection we didn't see being made.
+    def track(self, guild_id):
+        self.last_active.setdefault(guild_id, self.clock())
+
+    def forget(self, guild_id):
+        self.last_active.pop(guild_id, None)
+
+    def idle_guilds(self, busy=lambda guild_id: False):
+        now = self.clock()
+        idle = []
+        for guild_id, last in list(self.last_active.items()):
+            if busy(guild_id):
+                self.last_active[guild_id] = now
+            elif now - last >= self.idle_timeout:
+                idle.append(guild_id)
+        return idle
+
+    # connected() lists guilds with a voice connection; ones we didn't see
+    # being made (e.g. restored by discord.py on reconnect) start their idle
+    # clock on the pass that finds them.
+    async def reap(self, release, busy, interval, connected=lambda: ()):
+        while True:
+            await asyncio.sleep(interval)
+            for guild_id in connected():
+                self.track(guild_id)
+            for guild_id in self.idle_guilds(busy):
+                self.forget(guild_id)
+                try:
+                    await release(guild_id)
+                except Exception:
+                    log.exception(f"Failed to release guild {guild_id}")
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_LEVELS = "WARNING,sqcobot=DEBUG,discord=INFO"
+
+
+# "WARNING,sqcobot=DEBUG,discord.gateway=ERROR" -> {"": "WARNING", ...}.
+# A bare level applies to the root logger.
+def parse_levels(spec):
+    levels = {}
+    for item in filter(None, (s.strip() for s in spec.split(','))):
+        name, _, level = item.rpartition('=')
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level!r}")
+        levels[name.strip()] = level
+    return levels
+
+
+# Token bucket per call site, so a hot loop can't flood the log (or the
+# CloudWatch bill). WARNING and above always go through. The next record
+# let through from a throttled site says how many were dropped.
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, rate=10.0, burst=50, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = self.clock()
+        tokens, last, dropped = self.buckets.get(key, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now, dropped + 1)
+            return False
+        if dropped:
+            record.dropped = dropped
+        self.buckets[key] = (tokens - 1, now, 0)
+        return True
+
+
+# One line per record: ts=... level=... logger=... msg="..." [dropped=N]
+class LogfmtFormatter(logging.Formatter):
+
+    def format(self, record):
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+        # Tracebacks arrive already folded into the message by QueueHandler;
+        # escaping newlines keeps each record one log event.
+        msg = (record.getMessage().replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        line = (f'ts={ts}.{int(record.msecs):03d}Z level={record.levelname} '
+                f'logger={record.name} msg="{msg}"')
+        if getattr(record, 'dropped', 0):
+            line += f' dropped={record.dropped}'
+        return line
+
+
+FORMATTERS = {
+    'logfmt': LogfmtFormatter,
+    'plain': lambda: logging.Formatter('[%(levelname)s] %(name)s: %(message)s'),
+}
+
+
+# levels comes from parse_levels(). Records are filtered and queued on the
+# calling thread (usually the event loop) and written to stdout by a listener
+# thread, so slow output never stalls the loop. Returns the listener; it is
+# flushed and stopped at exit.
+def setup_logging(levels=None, fmt='logfmt', rate=10.0, burst=50,
+                  stream=None):
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(RateLimitFilter(rate, burst))
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(FORMATTERS[fmt]())
+    listener = QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    for name, level in (levels or parse_levels(DEFAULT_LEVELS)).items():
+        logging.getLogger(name or None).setLevel(level)
+
+    listener.start()
+    atexit.register(_stop, listener)
+    return listener
+
+
+def _stop(listener):
+    # QueueListener.stop() can't be called twice.
+    if listener._thread is not None:
+        listener.stop()
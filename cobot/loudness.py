@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+
+from cobot.blobstore import write_atomic
+from cobot.filelock import FileLock
+
+log = logging.getLogger('sqcobot.loudness')
+
+# The loudnorm measurements filter_settings() feeds into the second pass.
+LOUDNESS_FIELDS = ('input_i', 'input_tp', 'input_lra', 'input_thresh')
+
+
+def parse_loudnorm_output(stderr: str):
+    # Lol ffmpeg doesn't meaningfully split output JSON from other junk.
+    inner = stderr.strip().split('{', 1)[1].split('}', 1)[0]
+    full = f"{{{inner}}}"
+    return json.loads(full)
+
+
+def parse_duration(stderr: str):
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not m:
+        return None
+    hours, minutes, seconds = m.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def loudnorm_command(fname):
+    return [
+        "ffmpeg", "-hide_banner", "-i", fname, "-af",
+        "loudnorm=print_format=json", "-f", "null", "-"
+    ]
+
+
+# Blocking variant of voice_bot.get_volume for worker processes. Also picks
+# the duration out of the same ffmpeg run.
+def measure_file(fname):
+    result = subprocess.run(loudnorm_command(fname),
+                            stderr=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL,
+                            check=True)
+    stderr = result.stderr.decode()
+    return parse_loudnorm_output(stderr), parse_duration(stderr)
+
+
+def file_digest(path, chunksize=1 << 16):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Loudness measurements keyed by audio content (sha256 or ETag). Written
+# through to a JSON file so repeat plays, and restarts, skip the ffmpeg
+# measurement pass.
+class LoudnessCache:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            log.exception(f"Ignoring unreadable loudness cache {self.path}")
+            return {}
+
+    def load(self):
+        self.entries.update(self._read())
+        if self.entries:
+            log.info(f"Loaded {len(self.entries)} loudness entries from {self.path}")
+
+    # Writes entries merged with whatever other processes saved meanwhile,
+    # and returns the ones only they had. Only touches its arguments, so it
+    # can run in a thread.
+    def _write(self, entries):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with FileLock(self.path):
+            theirs = {k: v for k, v in self._read().items() if k not in entries}
+            write_atomic(self.path, json.dumps({**theirs, **entries}).encode())
+        return theirs
+
+    def save(self):
+        if self.path:
+            self.entries.update(self._write(dict(self.entries)))
+
+    # save() with the file work in a thread. The entries are copied here, on
+    # the loop, since put() may run while the thread writes.
+    async def save_async(self):
+        if self.path:
+            theirs = await asyncio.to_thread(self._write, dict(self.entries))
+            for key, loudness in theirs.items():
+                self.entries.setdefault(key, loudness)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, loudness):
+        self.entries[key] = {f: loudness[f] for f in LOUDNESS_FIELDS}
+
+    async def measure(self, file_path, measure_fn, key=None):
+        if key is None:
+            key = await asyncio.to_thread(file_digest, file_path)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        loudness = await measure_fn(file_path)
+        self.put(key, loudness)
+        try:
+            await self.save_async()
+        except OSError:
+            log.exception(f"Failed to save loudness cache {self.path}")
+        return self.entries[key]
@@ -0,0 +1,80 @@
+import os
+import resource
+import tracemalloc
+from collections import Counter
+
+
+def _proc_status(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    return _proc_status("VmRSS")
+
+
+def peak_rss_bytes():
+    peak = _proc_status("VmHWM")
+    if peak is None:
+        # ru_maxrss is KiB on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+# Which part of the bot an allocation belongs to: our own modules by name,
+# third-party code by top-level package.
+def subsystem_of(filename):
+    parts = filename.replace(os.sep, "/").split("/")
+    if "cobot" in parts[:-1]:
+        return "cobot." + os.path.splitext(parts[-1])[0]
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            rest = parts[parts.index(marker) + 1:]
+            if rest:
+                return os.path.splitext(rest[0])[0]
+    return "other"
+
+
+# Traced Python allocations grouped by subsystem, largest first. None unless
+# tracemalloc was started (--tracemalloc), since tracing itself costs memory.
+def traced_by_subsystem(limit=10):
+    if not tracemalloc.is_tracing():
+        return None
+    sizes = Counter()
+    for stat in tracemalloc.take_snapshot().statistics("filename"):
+        sizes[subsystem_of(stat.traceback[0].filename)] += stat.size
+    return sizes.most_common(limit)
+
+
+def format_bytes(n):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GiB"
+
+
+# counts: {"what": number} for caches worth keeping an eye on.
+def render_report(counts):
+    rss, peak = rss_bytes(), peak_rss_bytes()
+    lines = [
+        f"rss {format_bytes(rss) if rss is not None else '?'}, "
+        f"peak {format_bytes(peak)}"
+    ]
+    traced = traced_by_subsystem()
+    if traced is None:
+        lines.append("tracemalloc off (start with --tracemalloc)")
+    else:
+        current, traced_peak = tracemalloc.get_traced_memory()
+        lines.append(f"traced {format_bytes(current)}, "
+                     f"peak {format_bytes(traced_peak)}")
+        lines.extend(f"  {name:<24}{format_bytes(size):>10}"
+                     for name, size in traced)
+    lines.extend(f"{name:<26}{count:>10}" for name, count in counts.items())
+    return "\n".join(lines)
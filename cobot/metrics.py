@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import discord
+
+log = logging.getLogger('sqcobot.metrics')
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# Latency samples for one stage. Quantiles come from the most recent
+# `window` samples; count and sum cover the whole process lifetime.
+class Histogram:
+
+    def __init__(self, window=1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self, qs=QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in qs}
+        return {
+            q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+            for q in qs
+        }
+
+
+# Per-stage histograms, overall and per guild. Guilds are kept in LRU order
+# and capped so a large bot doesn't grow this without bound. observe() may be
+# called from discord.py's audio thread.
+class Metrics:
+
+    def __init__(self, max_guilds=100, window=1024):
+        self.max_guilds = max_guilds
+        self.window = window
+        self.stages = {}
+        self.guilds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _histogram(self, table, stage):
+        if stage not in table:
+            table[stage] = Histogram(self.window)
+        return table[stage]
+
+    def observe(self, stage, seconds, guild=None):
+        with self._lock:
+            self._histogram(self.stages, stage).observe(seconds)
+            if guild is None:
+                return
+            if guild not in self.guilds:
+                self.guilds[guild] = {}
+                if len(self.guilds) > self.max_guilds:
+                    self.guilds.popitem(last=False)
+            self.guilds.move_to_end(guild)
+            self._histogram(self.guilds[guild], stage).observe(seconds)
+
+    @contextmanager
+    def span(self, stage, guild=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, guild)
+
+    def _rows(self, guild=None):
+        with self._lock:
+            table = self.stages if guild is None else self.guilds.get(guild, {})
+            return [(stage, h.count, h.quantiles())
+                    for stage, h in sorted(table.items())]
+
+    def render_text(self, guild=None):
+        lines = [f"{'stage':<16}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for stage, count, q in self._rows(guild):
+            lines.append(f"{stage:<16}{count:>7}" +
+                         "".join(f"{q[p] * 1000:>7.0f}ms" for p in QUANTILES))
+        return "\n".join(lines)
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP cobot_stage_seconds Latency of each /play pipeline stage.",
+            "# TYPE cobot_stage_seconds summary",
+        ]
+        with self._lock:
+            tables = [(None, self.stages)] + list(self.guilds.items())
+            for guild, table in tables:
+                for stage, h in sorted(table.items()):
+                    labels = f'stage="{stage}"'
+                    if guild is not None:
+                        labels += f',guild="{guild}"'
+                    for q, v in h.quantiles().items():
+                        lines.append(
+                            f'cobot_stage_seconds{{{labels},quantile="{q}"}} {v:.6f}')
+                    lines.append(f"cobot_stage_seconds_sum{{{labels}}} {h.total:.6f}")
+                    lines.append(f"cobot_stage_seconds_count{{{labels}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+# Calls on_first_packet (from the audio thread) the first time the voice
+# client pulls a frame, i.e. when the user starts hearing the sound.
+class FirstPacketTimer(discord.AudioSource):
+
+    def __init__(self, source, on_first_packet):
+        self.source = source
+        self._on_first_packet = on_first_packet
+
+    def read(self):
+        data = self.source.read()
+        if self._on_first_packet is not None:
+            callback, self._on_first_packet = self._on_first_packet, None
+            try:
+                callback()
+            except Exception:
+                log.exception("First packet callback failed")
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+async def start_http_server(metrics, host, port):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render_prometheus(),
+                            content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+
+import discord
+import numpy as np
+
+log = logging.getLogger('sqcobot.mixer')
+
+# discord.py wants 20ms of 48kHz stereo s16le per read().
+SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME * discord.opus.Encoder.CHANNELS
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def decode_command(file_path, audio_filter):
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", file_path,
+        "-af", audio_filter, "-f", "s16le", "-ar", "48000", "-ac", "2", "-"
+    ]
+
+
+async def decode_pcm(file_path, audio_filter):
+    process = await asyncio.create_subprocess_exec(
+        *decode_command(file_path, audio_filter),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed to decode {file_path}: {stderr.decode().strip()}")
+    return np.frombuffer(stdout, dtype='<i2')
+
+
+# One per guild. Sums every active PCM stream into 20ms frames and clips the
+# result, so several sounds can play over each other through a single voice
+# client. read() returns b'' once everything has finished, which ends the
+# player; ensure_playing() starts it again when new sounds arrive.
+class MixerSource(discord.AudioSource):
+
+    def __init__(self, max_streams=8):
+        self.max_streams = max_streams
+        self._streams = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._streams)
+
+    def add(self, pcm):
+        with self._lock:
+            if len(self._streams) >= self.max_streams:
+                self._streams.pop(0)
+            self._streams.append([pcm, 0])
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+
+    def read(self):
+        with self._lock:
+            if not self._streams:
+                return b''
+            mixed = np.zeros(SAMPLES_PER_FRAME, dtype=np.int32)
+            for stream in self._streams:
+                pcm, offset = stream
+                chunk = pcm[offset:offset + SAMPLES_PER_FRAME]
+                mixed[:len(chunk)] += chunk
+                stream[1] = offset + SAMPLES_PER_FRAME
+            self._streams = [s for s in self._streams if s[1] < len(s[0])]
+        np.clip(mixed, INT16_MIN, INT16_MAX, out=mixed)
+        return mixed.astype('<i2').tobytes()
+
+    # The player calls this when it stops; the mix bus outlives each run.
+    def cleanup(self):
+        pass
+
+    def ensure_playing(self, vc, loop):
+        if vc.is_playing() or not vc.is_connected():
+            return
+
+        def after(error):
+            if error:
+                log.error(f"Mixer playback failed: {error}")
+            # Sounds added while the player was winding down.
+            if self.active:
+                loop.call_soon_threadsafe(self.ensure_playing, vc, loop)
+
+        vc.play(self, after=after)
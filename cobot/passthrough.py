@@ -0,0 +1,110 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+
+import discord
+from discord.oggparse import OggStream
+
+log = logging.getLogger('sqcobot.passthrough')
+
+OPUS_HEADER_PACKETS = (b'OpusHead', b'OpusTags')
+
+
+# Plays an Ogg/Opus file by handing its packets straight to the voice client:
+# no ffmpeg, no PCM decode and no re-encode in discord.py's audio thread.
+# Discord wants 48kHz stereo in 20ms frames, which is what OpusCache writes.
+class OggOpusAudio(discord.AudioSource):
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._packets = [
+                p for p in OggStream(f).iter_packets()
+                if not p.startswith(OPUS_HEADER_PACKETS)
+            ]
+        self._index = 0
+
+    def read(self):
+        if self._index >= len(self._packets):
+            return b''
+        packet = self._packets[self._index]
+        self._index += 1
+        return packet
+
+    def is_opus(self):
+        return True
+
+
+def normalize_command(src_path, dest_path, audio_filter):
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", src_path,
+        "-af", audio_filter, "-ar", "48000", "-ac", "2", "-c:a", "libopus",
+        "-b:a", "96k", "-frame_duration", "20", "-f", "ogg", dest_path
+    ]
+
+
+# Loudness-normalized Opus copies of each clip, keyed like the loudness cache
+# plus the filter they were made with, so the filter is paid for once per clip
+# instead of once per play, and a new measurement (e.g. from another
+# --analyzer) makes a new copy. Files are kept within max_bytes, least
+# recently played first out; the directory may be shared between processes,
+# so recency is the file's mtime.
+class OpusCache:
+
+    def __init__(self, cache_dir, limit=None, max_bytes=None):
+        self.cache_dir = cache_dir
+        # Bounds concurrent encodes, e.g. voice_bot's ffmpeg_slots.
+        self.limit = limit or contextlib.nullcontext()
+        self.max_bytes = max_bytes
+
+    def path_for(self, key, audio_filter):
+        digest = hashlib.sha256(audio_filter.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}-{digest}.opus")
+
+    async def get(self, src_path, key, audio_filter):
+        dest_path = self.path_for(key, audio_filter)
+        try:
+            os.utime(dest_path)
+            return dest_path
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{dest_path}.{os.getpid()}.{id(asyncio.current_task())}.tmp"
+        async with self.limit:
+            process = await asyncio.create_subprocess_exec(
+                *normalize_command(src_path, tmp_path, audio_filter),
+                stderr=asyncio.subprocess.PIPE)
+            _, stderr = await process.communicate()
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise RuntimeError(
+                f"ffmpeg failed to normalize {src_path}: {stderr.decode().strip()}")
+        os.replace(tmp_path, dest_path)
+        log.info(f"Normalized {src_path} to {dest_path}")
+        if self.max_bytes is not None:
+            await asyncio.to_thread(self.evict, keep=dest_path)
+        return dest_path
+
+    def evict(self, keep=None):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".opus"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+                log.info(f"Evicted {path} from Opus cache")
+            except FileNotFoundError:
+                pass
+            total -= size
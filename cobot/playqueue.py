@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from collections import deque
+
+log = logging.getLogger('sqcobot.playqueue')
+
+POLICIES = ("enqueue", "preempt", "drop")
+
+
+# What a guild does with a /play that arrives while something is playing:
+# enqueue: play it after the current sound (at most max_size waiting; the
+#   oldest waiting sound is dropped to make room).
+# preempt: stop the current sound and play this one.
+# drop: refuse it.
+# submit() says which happened: "playing", "queued" or "dropped".
+#
+# Plays are queued as coroutine functions that build the audio source, so a
+# waiting sound doesn't hold an ffmpeg process. If slots is given, a source
+# is only built once one is free, and the slot is held until it finishes
+# playing; share it between queues for a limit across guilds.
+class PlayQueue:
+
+    def __init__(self, loop, policy="enqueue", max_size=5, slots=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown play policy {policy}")
+        self.loop = loop
+        self.policy = policy
+        self.waiting = deque()
+        self.max_size = max_size
+        self.slots = slots
+        self.starting = None
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def busy(self, vc):
+        return self.starting is not None or vc.is_playing()
+
+    def submit(self, vc, make_source):
+        if not self.busy(vc):
+            self._start(vc, make_source)
+            return "playing"
+        if self.policy == "drop":
+            return "dropped"
+        if self.policy == "preempt":
+            self.clear()
+            vc.stop()
+            self._start(vc, make_source)
+            return "playing"
+        if len(self.waiting) >= self.max_size:
+            self.waiting.popleft()
+        self.waiting.append(make_source)
+        return "queued"
+
+    # Drops waiting sounds and one that is still being started.
+    def clear(self):
+        self.waiting.clear()
+        if self.starting is not None:
+            self.starting.cancel()
+            self.starting = None
+
+    def _start(self, vc, make_source):
+        self.starting = self.loop.create_task(self._play(vc, make_source))
+
+    async def _play(self, vc, make_source):
+        task = asyncio.current_task()
+        if self.slots is not None:
+            await self.slots.acquire()
+        try:
+            source = await make_source()
+        except asyncio.CancelledError:
+            self._release()
+            raise
+        except Exception:
+            log.exception("Failed to start playback")
+            self._release()
+            if self.starting is task:
+                self.starting = None
+                self._advance(vc)
+            return
+
+        def after(error):
+            if error:
+                log.error(f"Playback failed: {error}")
+            self.loop.call_soon_threadsafe(self._finished, vc)
+
+        if self.starting is task:
+            self.starting = None
+        try:
+            vc.play(source, after=after)
+        except Exception:
+            log.exception("Failed to start playback")
+            source.cleanup()
+            self._release()
+
+    def _release(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def _finished(self, vc):
+        self._release()
+        self._advance(vc)
+
+    def _advance(self, vc):
+        if not self.waiting or self.busy(vc):
+            return
+        if not vc.is_connected():
+            self.clear()
+            return
+        self._start(vc, self.waiting.popleft())
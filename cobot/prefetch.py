@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+
+log = logging.getLogger('sqcobot.prefetch')
+
+
+# Which autocomplete results are worth warming: all of a short list, or the
+# few that clearly beat everything else.
+def likely_choices(scored, short_list=3, high_score=90, max_high=2):
+    if not scored or scored[0][1] == 0:
+        return []
+    if len(scored) <= short_list:
+        return [key for key, _ in scored]
+    high = [key for key, score in scored if score >= high_score]
+    return high if len(high) <= max_high else []
+
+
+# Runs `warm(sound_name)` (download + loudness analysis) ahead of /play for
+# sounds the user is probably about to pick. At most `concurrency` warms run
+# at once and at most `max_pending` are queued; a newer request from the same
+# group (guild) cancels the older guesses it no longer includes. Sounds
+# warmed within `ttl` seconds are skipped.
+class Prefetcher:
+
+    def __init__(self, warm, concurrency=2, max_pending=8, ttl=60,
+                 history=50):
+        self.warm = warm
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.pending = OrderedDict()
+        self.warmed = OrderedDict()
+        self.recent = deque(maxlen=history)
+        self.counts = Counter()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def record_play(self, sound_name):
+        self.recent.append(sound_name)
+        self.counts[sound_name] += 1
+        self.warmed[sound_name] = time.monotonic()
+        self.warmed.move_to_end(sound_name)
+
+    def hot(self, n):
+        names = list(dict.fromkeys(reversed(self.recent)))[:n]
+        for name, _ in self.counts.most_common(n):
+            if name not in names:
+                names.append(name)
+        return names[:n]
+
+    def _fresh(self, sound_name):
+        warmed_at = self.warmed.get(sound_name)
+        return warmed_at is not None and time.monotonic() - warmed_at < self.ttl
+
+    def request(self, names, group=None):
+        if group is not None:
+            for (g, name), task in list(self.pending.items()):
+                if g == group and name not in names:
+                    task.cancel()
+        for name in names:
+            if self._fresh(name) or any(n == name for _, n in self.pending):
+                continue
+            while len(self.pending) >= self.max_pending:
+                _, oldest = self.pending.popitem(last=False)
+                oldest.cancel()
+            key = (group, name)
+            task = asyncio.create_task(self._run(name))
+            task.add_done_callback(lambda _, key=key: self.pending.pop(key, None))
+            self.pending[key] = task
+
+    async def _run(self, sound_name):
+        async with self._semaphore:
+            try:
+                await self.warm(sound_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f"Prefetch of {sound_name} failed")
+                return
+        self.warmed[sound_name] = time.monotonic()
+        self.warmed.move_to_end(sound_name)
+        while len(self.warmed) > self.max_pending * 16:
+            self.warmed.popitem(last=False)
+        log.debug(f"Prefetched {sound_name}")
+
+    def cancel_all(self):
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import subprocess
+
+import numpy as np
+
+# EBU R128 / ITU-R BS.1770-4 loudness measurement on decoded PCM, producing
+# the same fields ffmpeg's loudnorm filter prints for filter_settings().
+# The clip is processed in fixed-size blocks so memory doesn't grow with its
+# length: K-weighting is an FFT convolution with the filters' impulse
+# response (overlap-save), reduced straight to energy per 100ms segment, and
+# true peak comes from 4x FFT oversampling of overlapping windows.
+
+RATE = 48000
+
+# BS.1770 K-weighting at 48kHz: high-shelf pre-filter, then RLB high-pass.
+SHELF_B = (1.53512485958697, -2.69169618940638, 1.19839281085285)
+SHELF_A = (1.0, -1.69065929318241, 0.73248077421585)
+HIGHPASS_B = (1.0, -2.0, 1.0)
+HIGHPASS_A = (1.0, -1.99004745483398, 0.99007225036621)
+
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+LRA_RELATIVE_GATE = -20.0
+OVERSAMPLE = 4
+# Gating blocks (400ms) and short-term windows (3s) both move in 100ms steps,
+# so they are sums of whole segments.
+SEGMENT = RATE // 10
+# Long enough for the 38Hz high-pass to ring out; the impulse response is cut
+# off here.
+FILTER_TAIL = RATE // 2
+FILTER_FFT = 1 << 16
+# Output frames per filter block: whole segments that fit beside the tail.
+FILTER_BLOCK = (FILTER_FFT - FILTER_TAIL) // SEGMENT * SEGMENT
+# True peak is oversampled in overlapping windows, which keeps the FFTs small
+# and a power of two; the margins absorb the wrap-around at window edges.
+PEAK_BLOCK = 4096
+PEAK_MARGIN = 256
+PEAK_BATCH = 16
+
+# ffmpeg's loudnorm rejects measured values outside these ranges.
+LIMITS = {
+    'input_i': (-99.0, 0.0),
+    'input_tp': (-99.0, 99.0),
+    'input_lra': (0.0, 99.0),
+    'input_thresh': (-99.0, 0.0),
+}
+
+
+def _response(b, a, n):
+    z = np.exp(-1j * np.pi * np.arange(n // 2 + 1) / (n // 2))
+    return np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+
+
+@functools.lru_cache(maxsize=1)
+def _kernel():
+    h = _response(SHELF_B, SHELF_A, FILTER_FFT) * _response(
+        HIGHPASS_B, HIGHPASS_A, FILTER_FFT)
+    impulse = np.fft.irfft(h, n=FILTER_FFT)[:FILTER_TAIL]
+    return np.fft.rfft(impulse, n=FILTER_FFT)[:, None]
+
+
+# pcm[start:stop] as float64, zero-filled where the range runs off the clip.
+def _frames(pcm, start, stop):
+    chunk = pcm[max(start, 0):min(stop, len(pcm))].astype(np.float64)
+    before = max(0, -start)
+    after = stop - start - before - len(chunk)
+    if before or after:
+        chunk = np.pad(chunk, ((before, after), (0, 0)))
+    return chunk
+
+
+# K-weighted energy (channels summed, their gains are 1.0 for L/R) of each
+# whole 100ms segment, and of the clip as a whole.
+def segment_energy(pcm):
+    frames = len(pcm)
+    segments = []
+    total = 0.0
+    for start in range(0, frames, FILTER_BLOCK):
+        stop = min(start + FILTER_BLOCK, frames)
+        chunk = _frames(pcm, start - FILTER_TAIL + 1, stop)
+        spectrum = np.fft.rfft(chunk, n=FILTER_FFT, axis=0) * _kernel()
+        weighted = np.fft.irfft(spectrum, n=FILTER_FFT,
+                                axis=0)[FILTER_TAIL - 1:len(chunk)]
+        energy = (weighted**2).sum(axis=1)
+        total += energy.sum()
+        whole = len(energy) // SEGMENT * SEGMENT
+        segments.append(energy[:whole].reshape(-1, SEGMENT).sum(axis=1))
+    return np.concatenate(segments) if segments else np.zeros(0), total
+
+
+def _block_power(segments, total, frames, length):
+    if len(segments) < length:
+        return np.array([total / frames if frames else 0.0])
+    cumsum = np.concatenate(([0.0], np.cumsum(segments)))
+    return (cumsum[length:] - cumsum[:-length]) / (length * SEGMENT)
+
+
+def _loudness(power):
+    with np.errstate(divide='ignore'):
+        return -0.691 + 10 * np.log10(power)
+
+
+def integrated_loudness(segments, total, frames):
+    power = _block_power(segments, total, frames, 4)
+    power = power[_loudness(power) > ABSOLUTE_GATE]
+    if not len(power):
+        return -np.inf, -np.inf
+    threshold = _loudness(power.mean()) + RELATIVE_GATE
+    gated = power[_loudness(power) > threshold]
+    return _loudness(gated.mean()), threshold
+
+
+def loudness_range(segments):
+    # Short-term (3s) loudness; clips shorter than one window have no range.
+    if len(segments) < 30:
+        return 0.0
+    power = _block_power(segments, 0.0, 0, 30)
+    power = power[_loudness(power) > ABSOLUTE_GATE]
+    if not len(power):
+        return 0.0
+    threshold = _loudness(power.mean()) + LRA_RELATIVE_GATE
+    short_term = _loudness(power[_loudness(power) > threshold])
+    low, high = np.percentile(short_term, [10, 95])
+    return high - low
+
+
+def true_peak(pcm):
+    frames = len(pcm)
+    if not frames:
+        return -np.inf
+    size = PEAK_BLOCK + 2 * PEAK_MARGIN
+    margin = PEAK_MARGIN * OVERSAMPLE
+    peak = 0.0
+    for start in range(0, frames, PEAK_BLOCK * PEAK_BATCH):
+        stop = min(start + PEAK_BLOCK * PEAK_BATCH, frames)
+        blocks = -(-(stop - start) // PEAK_BLOCK)
+        chunk = _frames(pcm, start - PEAK_MARGIN,
+                        start + blocks * PEAK_BLOCK + PEAK_MARGIN)
+        windows = np.lib.stride_tricks.sliding_window_view(
+            chunk, size, axis=0)[::PEAK_BLOCK]
+        upsampled = np.fft.irfft(np.fft.rfft(windows, axis=-1),
+                                 n=size * OVERSAMPLE,
+                                 axis=-1) * OVERSAMPLE
+        peak = max(peak, np.abs(chunk).max(),
+                   np.abs(upsampled[..., margin:-margin]).max())
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(peak)
+
+
+def _field(name, value):
+    low, high = LIMITS[name]
+    return f"{min(max(float(value), low), high):.2f}"
+
+
+# pcm: float array of shape (frames, channels) at 48kHz, full scale = 1.0.
+def analyze(pcm):
+    # Blocks are converted to float64 as they are processed; the clip itself
+    # stays in whatever float type it was decoded to.
+    pcm = np.asarray(pcm)
+    if pcm.ndim == 1:
+        pcm = pcm[:, None]
+    segments, total = segment_energy(pcm)
+    integrated, threshold = integrated_loudness(segments, total, len(pcm))
+    return {
+        'input_i': _field('input_i', integrated),
+        'input_tp': _field('input_tp', true_peak(pcm)),
+        'input_lra': _field('input_lra', loudness_range(segments)),
+        'input_thresh': _field('input_thresh', threshold),
+    }
+
+
+def analyze_batch(pcms):
+    return [analyze(pcm) for pcm in pcms]
+
+
+def decode_command(fname):
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", fname, "-f",
+        "f32le", "-ac", "2", "-ar", str(RATE), "-"
+    ]
+
+
+def pcm_from_bytes(raw):
+    return np.frombuffer(raw, dtype='<f4').reshape(-1, 2)
+
+
+async def decode_file(fname):
+    process = await asyncio.create_subprocess_exec(
+        *decode_command(fname),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed to decode {fname}: {stderr.decode().strip()}")
+    return pcm_from_bytes(stdout)
+
+
+# Drop-in for voice_bot.get_volume: a plain decode instead of a loudnorm
+# pass, with the measurement done here off the event loop.
+async def measure(fname):
+    pcm = await decode_file(fname)
+    return await asyncio.to_thread(analyze, pcm)
+
+
+# Blocking variant for cobot.analyze worker processes, shaped like
+# cobot.loudness.measure_file.
+def measure_file(fname):
+    result = subprocess.run(decode_command(fname),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            check=True)
+    pcm = pcm_from_bytes(result.stdout)
+    return analyze(pcm), len(pcm) / RATE
@@ -0,0 +1,39 @@
+import asyncio
+
+
+# Coalesces concurrent calls for the same key into one: the first caller
+# starts fn(), everyone who asks while it is running awaits the same result
+# (or exception). A cancelled caller only stops waiting while others still
+# wait on the work; once the last one is cancelled the work is cancelled
+# too, so abandoned prefetches don't keep running.
+class SingleFlight:
+
+    def __init__(self):
+        self.flights = {}
+        self.waiters = {}
+
+    def __len__(self):
+        return len(self.flights)
+
+    def _done(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+            self.waiters.pop(key, None)
+
+    async def run(self, key, fn, *args):
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self.flights[key] = task
+            self.waiters[key] = 0
+            task.add_done_callback(lambda t: self._done(key, t))
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters.get(key) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            if self.flights.get(key) is task:
+                self.waiters[key] -= 1
@@ -0,0 +1,32 @@
+import json
+import logging
+import time
+
+log = logging.getLogger('sqcobot.snapshot')
+
+SNAPSHOT_VERSION = 1
+
+
+# What a restarted bot needs to be useful straight away, as written by
+# voice_bot.snapshot_state(). Anything older than max_age is ignored, as are
+# snapshots from another format version.
+def parse_snapshot(data, max_age):
+    try:
+        state = json.loads(data)
+    except ValueError:
+        log.exception("Ignoring unreadable snapshot")
+        return None
+    if state.get("version") != SNAPSHOT_VERSION:
+        log.warning(f"Ignoring snapshot version {state.get('version')}")
+        return None
+    age = time.time() - state.get("created", 0)
+    if age > max_age:
+        log.info(f"Ignoring snapshot from {age:.0f}s ago")
+        return None
+    return state
+
+
+def dump_snapshot(state):
+    return json.dumps(dict(state, version=SNAPSHOT_VERSION,
+                           created=time.time())).encode()
+
@@ -3,38 +3,50 @@ import asyncio
 import json
 import logging
 import os
-import re
-import tempfile
+import signal
+import time
+import tracemalloc
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from fuzzywuzzy import fuzz
 
-from cobot.audio_source import LocalAudioSource, S3AudioSource
+from cobot.audio_source import (CachedAudioSource, LocalAudioSource,
+                                S3AudioSource)
+from cobot.analyze import load_source_manifest
+from cobot.autocomplete import SoundIndex, depunctuate
+from cobot.blobstore import LocalBlobStore, S3BlobStore, write_atomic
+from cobot.browser import PageCache, SoundBrowser
+from cobot.bundle import (BundleAudioSource, FileBundleReader,
+                          S3BundleReader)
+from cobot.commandsync import FINGERPRINT_NAME, sync_if_changed
+from cobot.catalog import Catalog, object_versions
+from cobot.logconfig import (DEFAULT_LEVELS, FORMATTERS, parse_levels,
+                             setup_logging)
+from cobot.lifecycle import VoiceLifecycle
+from cobot.loudness import (LoudnessCache, file_digest, loudnorm_command,
+                            parse_loudnorm_output)
+from cobot.memory import render_report
+from cobot.metrics import FirstPacketTimer, Metrics, start_http_server
+from cobot.passthrough import OggOpusAudio, OpusCache
+from cobot.playqueue import POLICIES, PlayQueue
+from cobot.prefetch import Prefetcher, likely_choices
+from cobot.singleflight import SingleFlight
+from cobot.snapshot import dump_snapshot, parse_snapshot
 
 log = logging.getLogger('sqcobot')
-log.setLevel(logging.DEBUG)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('[%(levelname)s] %(message)s')
-ch.setFormatter(formatter)
-log.addHandler(ch)
-logging.getLogger('discord').addHandler(ch)
-logging.getLogger('discord').setLevel(logging.DEBUG)
 
 
 # Print discord.py version and git tag if available
-def print_discordpy_version():
+def log_discordpy_version():
     version = getattr(discord, '__version__', 'unknown')
     git_tag = getattr(discord, '__git_revision__', None)
-    print(f"[INFO] discord.py version: {version}")
+    log.info(f"discord.py version: {version}")
     if git_tag:
-        print(f"[INFO] discord.py git revision: {git_tag}")
+        log.info(f"discord.py git revision: {git_tag}")
 
 
-print_discordpy_version()
-
 # Feed loudness measurements from the previous run into
 # the one that actually plays the sound.
 # Shoot for a (totally arbitrary; change me)
@@ -54,27 +66,15 @@ def filter_settings(loudness):
 
 
 async def get_volume(fname):
-    process = await asyncio.create_subprocess_exec(
-        "ffmpeg",
-        "-hide_banner",
-        "-i",
-        fname,
-        "-af",
-        "loudnorm=print_format=json",
-        "-f",
-        "null",
-        "-",
-        stderr=asyncio.subprocess.PIPE)
-    _, stderr = await process.communicate()
-    s = stderr.decode().strip()
-    # Lol ffmpeg doesn't meaningfully split output JSON from other junk.
-    inner = s.split('{', 1)[1].split('}', 1)[0]
-    full = f"{{{inner}}}"
-    return json.loads(full)
-
-
-def depunctuate(name: str):
-    return re.sub(r'[\W_]+', '', name).lower()
+    async with ffmpeg_slots:
+        if args.analyzer == 'numpy':
+            # numpy is imported on first use, like the mixer.
+            from cobot import r128
+            return await r128.measure(fname)
+        process = await asyncio.create_subprocess_exec(
+            *loudnorm_command(fname), stderr=asyncio.subprocess.PIPE)
+        _, stderr = await process.communicate()
+        return parse_loudnorm_output(stderr.decode())
 
 
 def get_fuzzy_match_scores(name: str, sounds):
@@ -85,14 +85,36 @@ def sound_name_to_filename(name):
     return f"{name}.ogg"
 
 
+# One client and thread pool for everything kept in $AUDIO_BUCKET: sounds,
+# the command fingerprint and snapshots.
+def bucket_source():
+    global s3_bucket
+    if s3_bucket is None:
+        s3_bucket = S3AudioSource(bucket_name=os.environ['AUDIO_BUCKET'])
+    return s3_bucket
+
+
 def get_audio_source(args):
     if args.mock_audio:
+        if args.audio_bundle:
+            return BundleAudioSource(FileBundleReader(args.audio_bundle))
         return LocalAudioSource(audio_dir=args.audio_dir)
-    else:
-        return S3AudioSource(bucket_name=os.environ['AUDIO_BUCKET'])
+    s3_source = bucket_source()
+    if args.audio_bundle:
+        return BundleAudioSource(
+            S3BundleReader(s3_source,
+                           args.audio_bundle,
+                           os.path.join(args.cache_dir, "bundle"),
+                           whole=args.bundle_fetch == "whole"))
+    return s3_source
 
 
-def parse_args():
+# True for COBOT_FOO=1/true/yes; unset, empty, 0 or false leave it off.
+def env_flag(name):
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'yes')
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Squadron Co-Bot VoiceBot")
     parser.add_argument(
         "--mock-audio",
@@ -102,30 +124,218 @@ def parse_args():
                         type=str,
                         default="sounds",
                         help="Directory for local audio files (mock mode)")
+    parser.add_argument(
+        "--audio-bundle",
+        type=str,
+        default=os.environ.get('COBOT_AUDIO_BUNDLE'),
+        help="Read sounds from a bundle built by cobot.bundle: a file path "
+        "with --mock-audio, otherwise its key in $AUDIO_BUCKET")
+    parser.add_argument(
+        "--bundle-fetch",
+        choices=["whole", "ranged"],
+        default=os.environ.get('COBOT_BUNDLE_FETCH', "whole"),
+        help="whole: download the S3 bundle once at startup. ranged: fetch "
+        "the index and each sound with byte-range GETs")
     parser.add_argument(
         "--guild",
         type=int,
         help="Guild ID for slash command registration (for instant testing)")
-    return parser.parse_args()
-
-
-args = parse_args()
-audio_source = get_audio_source(args)
-
-intents = discord.Intents.default()
-intents.guild_messages = True
-intents.dm_messages = True
-intents.message_content = True
-intents.messages = True
-intents.voice_states = True
-
-description = 'Kernels of wisdom from fighter pilot legends.'
-bot = commands.Bot(intents=intents,
-                   command_prefix='!co-',
-                   description=description)
-tree = bot.tree
+    parser.add_argument(
+        "--command-sync",
+        choices=["changed", "always", "never"],
+        default=os.environ.get('COBOT_COMMAND_SYNC', "changed"),
+        help="When to upload slash commands to Discord on startup: only if "
+        "their definitions changed since the last sync, every time, or never")
+    parser.add_argument(
+        "--command-sync-store",
+        choices=["local", "bucket"],
+        default=os.environ.get('COBOT_COMMAND_SYNC_STORE', "local"),
+        help="Where the fingerprint of the last synced commands is kept: "
+        "the cache directory, or $AUDIO_BUCKET")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=os.environ.get(
+            'COBOT_CACHE_DIR', os.path.expanduser("~/.cache/cobot")),
+        help="Directory for caches that should survive restarts")
+    parser.add_argument(
+        "--audio-cache-mb",
+        type=int,
+        default=int(os.environ.get('COBOT_AUDIO_CACHE_MB', '512')),
+        help="Disk budget for downloaded sounds, least recently played "
+        "are evicted first")
+    parser.add_argument(
+        "--opus-cache-mb",
+        type=int,
+        default=int(os.environ.get('COBOT_OPUS_CACHE_MB', '256')),
+        help="Disk budget for normalized Opus copies (passthrough playback), "
+        "least recently played are evicted first")
+    parser.add_argument(
+        "--audio-cache-max-age",
+        type=int,
+        default=300,
+        help="Seconds before a cached sound is revalidated by ETag")
+    parser.add_argument(
+        "--playback",
+        choices=["pcm", "passthrough", "mix"],
+        default=os.environ.get('COBOT_PLAYBACK', "pcm"),
+        help="pcm: decode, filter and re-encode every play with ffmpeg. "
+        "passthrough: normalize each clip to Opus once, then send its "
+        "packets as-is. mix: layer overlapping plays in one guild through "
+        "a shared in-process mixer")
+    parser.add_argument(
+        "--analyzer",
+        choices=["numpy", "ffmpeg"],
+        default=os.environ.get('COBOT_ANALYZER', "numpy"),
+        help="numpy: decode once and measure EBU R128 loudness in-process. "
+        "ffmpeg: run a separate loudnorm measurement pass")
+    parser.add_argument(
+        "--play-policy",
+        choices=POLICIES,
+        default=os.environ.get('COBOT_PLAY_POLICY', "enqueue"),
+        help="What a /play does while the guild is already playing: wait "
+        "its turn, cut off the current sound, or be refused")
+    parser.add_argument("--play-queue-size",
+                        type=int,
+                        default=5,
+                        help="Sounds that may wait per guild (enqueue policy)")
+    parser.add_argument(
+        "--ffmpeg-jobs",
+        type=int,
+        default=int(os.environ.get('COBOT_FFMPEG_JOBS', '2')),
+        help="Maximum ffmpeg analysis/encode processes at once, across "
+        "all guilds (playback is limited by --playback-jobs)")
+    parser.add_argument(
+        "--playback-jobs",
+        type=int,
+        default=int(os.environ.get('COBOT_PLAYBACK_JOBS', '8')),
+        help="Maximum sounds playing through ffmpeg at once, across all "
+        "guilds (pcm playback); further plays wait their turn")
+    parser.add_argument(
+        "--low-memory",
+        action=argparse.BooleanOptionalAction,
+        default=env_flag('COBOT_LOW_MEMORY'),
+        help="Only the gateway intents and caches slash commands need, and "
+        "smaller in-process caches")
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        default=env_flag('COBOT_TRACEMALLOC'),
+        help="Trace Python allocations so /memory can break usage down "
+        "by subsystem (costs some memory itself)")
+    parser.add_argument(
+        "--log-levels",
+        type=parse_levels,
+        default=os.environ.get('COBOT_LOG_LEVELS', DEFAULT_LEVELS),
+        help="Comma separated logger=LEVEL pairs; a bare LEVEL sets the "
+        f"root logger (default: {DEFAULT_LEVELS})")
+    parser.add_argument("--log-format",
+                        choices=sorted(FORMATTERS),
+                        default=os.environ.get('COBOT_LOG_FORMAT', "logfmt"),
+                        help="Output format for log lines")
+    parser.add_argument(
+        "--log-rate",
+        type=float,
+        default=float(os.environ.get('COBOT_LOG_RATE', '10')),
+        help="Sustained records per second allowed from one log call site "
+        "below WARNING (0 disables the limit)")
+    parser.add_argument("--log-burst",
+                        type=int,
+                        default=50,
+                        help="Records one call site may log in a burst")
+    parser.add_argument(
+        "--voice-idle-timeout",
+        type=int,
+        default=int(os.environ.get('COBOT_VOICE_IDLE_TIMEOUT', '600')),
+        help="Leave a voice channel after this many seconds without a "
+        "/play, /join or /summon (0 stays connected)")
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        help="Run as an AutoShardedBot with this many shards in total")
+    parser.add_argument(
+        "--shard-ids",
+        type=lambda s: [int(i) for i in s.split(',')],
+        help="Comma separated shards this process should run "
+        "(see cobot.launcher)")
+    parser.add_argument(
+        "--cached-catalog",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Serve the sound list saved by the previous run while the "
+        "fresh listing loads")
+    parser.add_argument(
+        "--snapshot-store",
+        choices=["none", "local", "bucket"],
+        default=os.environ.get('COBOT_SNAPSHOT_STORE', "local"),
+        help="Where to save the catalog, loudness, hot sounds and voice "
+        "channels on SIGTERM, to restore them on the next start: nowhere, "
+        "the cache directory, or $AUDIO_BUCKET")
+    parser.add_argument(
+        "--snapshot-max-age",
+        type=int,
+        default=3600,
+        help="Ignore snapshots older than this many seconds")
+    parser.add_argument(
+        "--catalog-refresh",
+        type=int,
+        default=300,
+        help="Seconds between checks of the audio source for added, removed "
+        "or replaced sounds (0 disables)")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.environ.get('COBOT_METRICS_PORT', '0')),
+        help="Serve Prometheus-format stage latencies on this port "
+        "(0 disables)")
+    parser.add_argument("--metrics-host",
+                        type=str,
+                        default="127.0.0.1",
+                        help="Address for the metrics endpoint")
+    parser.add_argument(
+        "--prefetch",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Download and analyze likely sounds while the user is still "
+        "picking one in autocomplete")
+    parser.add_argument("--prefetch-concurrency",
+                        type=int,
+                        default=2,
+                        help="Maximum prefetches running at once")
+    return parser.parse_args(argv)
+
+
+# Everything below is set up by main(), so importing this module is cheap and
+# has no side effects.
+args = None
+bot = None
+s3_bucket = None
+audio_source = None
+loudness_cache = None
+opus_cache = None
+prefetcher = None
+ffmpeg_slots = None
+playback_slots = None
+lifecycle = None
+commands_synced = False
+restored_voice = []
 
 sounds = {}
+sound_index = SoundIndex()
+catalog = Catalog()
+background_tasks = set()
+mixers = {}
+play_queues = {}
+flights = SingleFlight()
+metrics = Metrics()
+list_pages = PageCache()
+
+SEARCH_LIMIT = 200
+SEARCH_MIN_SCORE = 70
+# Sounds from the audio cache to fetch again after a restart.
+SNAPSHOT_WARM = 20
+# Spot interruptions allow 30s between SIGTERM and SIGKILL by default.
+SNAPSHOT_TIMEOUT = 10
 
 
 def guild_obj():
@@ -136,22 +346,6 @@ def guild_decorator():
     return {"guild": guild_obj()} if args.guild else {}
 
 
-def chunk_strings_into(li, chunksize):
-    chunked = []
-    chunk = []
-    total = 0
-    for s in li:
-        if total + len(s) + 1 > chunksize and chunk:
-            chunked.append(chunk)
-            chunk = []
-            total = 0
-        chunk.append(s)
-        total += len(s) + 1
-    if chunk:
-        chunked.append(chunk)
-    return chunked
-
-
 async def join_channel(ctx, channel):
     if ctx.voice_client is not None:
         await ctx.voice_client.move_to(channel)
@@ -159,29 +353,27 @@ async def join_channel(ctx, channel):
         await channel.connect()
 
 
-@tree.command(name='list', description='List possible sounds')
+@app_commands.command(name='list', description='List possible sounds')
 async def list_sounds(interaction: discord.Interaction):
-    HELP_MSG_PREAMBLE = 'These are the topics I can tell you about:\n'
-    max_len = 2000 - len(HELP_MSG_PREAMBLE) - 8  # 8 for code block
-    sounds_sorted = sorted(sounds.values())
-    chunks = chunk_strings_into(sounds_sorted, max_len)
-    await interaction.response.defer(ephemeral=True)
-    try:
-        user = interaction.user
-        dm = await user.create_dm()
-        for i, chunk in enumerate(chunks):
-            msg = HELP_MSG_PREAMBLE if i == 0 else ""
-            msg += "```\n" + "\n".join(chunk) + "\n```"
-            await dm.send(msg)
-        await interaction.followup.send(
-            "I've sent you a DM with the sound list.", ephemeral=True)
-    except Exception:
-        log.exception("Failed to DM sound list")
-        await interaction.followup.send(
-            "Failed to send DM. Do you have DMs disabled?", ephemeral=True)
+    if not sounds:
+        await interaction.response.send_message(
+            "The sound list is still loading, try again in a moment.",
+            ephemeral=True)
+        return
+    pages = list_pages.get(catalog.generation, sounds.values())
+    browser = SoundBrowser(pages, search_sounds)
+    await interaction.response.send_message(browser.content(),
+                                            view=browser,
+                                            ephemeral=True)
 
 
-AUDIO_TMPDIR = tempfile.mkdtemp(prefix="cobot_audio_")
+# Matches for the /list filter box, best first, using the autocomplete index.
+def search_sounds(query):
+    return [
+        sounds[key]
+        for key, score in sound_index.top_scored(query, SEARCH_LIMIT)
+        if score >= SEARCH_MIN_SCORE
+    ]
 
 
 async def sound_name_autocomplete(
@@ -189,21 +381,80 @@ async def sound_name_autocomplete(
         current: str) -> list[app_commands.Choice[str]]:
     if not sounds:
         return []
-    scores: dict[str, int] = get_fuzzy_match_scores(current, sounds)
-    # Sort by score, highest first
-    sorted_keys = sorted(scores, key=lambda x: scores[x], reverse=True)
-    # Limit to 20 results (Discord's limit)
-    return [
-        app_commands.Choice(name=sounds[k], value=sounds[k])
-        for k in sorted_keys[:20]
-    ]
+    with metrics.span('autocomplete', interaction.guild_id):
+        # Limit to 20 results (Discord's limit)
+        scored = sound_index.top_scored(current, 20)
+        if args.prefetch:
+            prefetcher.request(
+                [sounds[k] for k in likely_choices(scored) if k in sounds],
+                group=interaction.guild_id)
+        return [
+            app_commands.Choice(name=sounds[k], value=sounds[k])
+            for k, _ in scored
+        ]
+
+
+# Everything play() does before it can start the source, minus the voice
+# connection. Concurrent calls for one sound (plays, prefetches) share a
+# single download and analysis.
+async def prepare_sound(sound_name):
+    return await flights.run(sound_name, _prepare_sound, sound_name)
+
+
+async def _prepare_sound(sound_name):
+    with metrics.span('download'):
+        file_path = await audio_source.download(sound_name)
+    if not os.path.exists(file_path):
+        log.error(f"Audio file does not exist: {file_path}")
+        raise FileNotFoundError(f"Audio file for `{sound_name}` not found.")
+    log.info(
+        f"Audio file exists: {file_path}, size={os.path.getsize(file_path)} bytes"
+    )
+    with metrics.span('analyze'):
+        digest, audio_filter = await get_audio_filter(file_path)
+        if args.playback == 'passthrough':
+            await opus_cache.get(file_path, digest, audio_filter)
+    return file_path, digest, audio_filter
+
+
+async def warm_sound(sound_name):
+    await prepare_sound(sound_name)
+
+
+async def get_audio_filter(file_path):
+    digest = await asyncio.to_thread(file_digest, file_path)
+    loudness = await loudness_cache.measure(file_path, get_volume, key=digest)
+    return digest, filter_settings(loudness)
+
+
+async def make_audio_source(file_path, digest, audio_filter):
+    if args.playback == 'passthrough':
+        opus_path = await opus_cache.get(file_path, digest, audio_filter)
+        log.info(f"Passing through Opus packets from {opus_path}")
+        return OggOpusAudio(opus_path)
+    log.info(f"FFmpeg options: -af {audio_filter}")
+    return discord.PCMVolumeTransformer(
+        discord.FFmpegPCMAudio(source=file_path,
+                               options=f"-af {audio_filter}"))
+
+
+async def mix_into(guild, vc, file_path, audio_filter):
+    # numpy is only needed in this mode.
+    from cobot.mixer import MixerSource, decode_pcm
+    async with ffmpeg_slots:
+        pcm = await decode_pcm(file_path, audio_filter)
+    mixer = mixers.setdefault(guild.id, MixerSource())
+    mixer.add(pcm)
+    mixer.ensure_playing(vc, asyncio.get_running_loop())
 
 
 # Update your play command to use autocomplete
-@tree.command(name='play', description='Play a sound')
+@app_commands.command(name='play', description='Play a sound')
 @app_commands.describe(sound_name='Name of the sound to play')
 @app_commands.autocomplete(sound_name=sound_name_autocomplete)
 async def play(interaction: discord.Interaction, sound_name: str):
+    start = time.perf_counter()
+    guild_id = interaction.guild_id
     if not sounds:
         await interaction.response.send_message(
             'Starting up, give me a minute!', ephemeral=True)
@@ -222,43 +473,102 @@ async def play(interaction: discord.Interaction, sound_name: str):
             'You must be in a voice channel to play sounds.', ephemeral=True)
         return
 
-    channel = user.voice.channel
-    await interaction.response.defer(ephemeral=True)
-
     assert interaction.guild is not None
-    if not interaction.guild.voice_client:
-        vc = await channel.connect()
-    else:
-        vc = interaction.guild.voice_client
+    guild = interaction.guild
+    channel = user.voice.channel
+    name = sounds[key]
+    mixing = args.playback == 'mix'
+    if (not mixing and args.play_policy == 'drop' and guild.voice_client
+            and guild.voice_client.is_playing()):
+        await interaction.response.send_message(
+            "Already playing a sound, try again when it's done.",
+            ephemeral=True)
+        return
 
-    assert vc is not None
-    assert isinstance(vc, discord.VoiceClient)
+    prefetcher.record_play(name)
+    lifecycle.touch(guild.id)
 
-    await interaction.followup.send(f'Playing `{sounds[key]}`.',
-                                    ephemeral=True)
+    async def prepare():
+        with metrics.span('prepare', guild_id):
+            return await prepare_sound(name)
 
+    # The voice handshake and preparing the audio don't depend on each other,
+    # so both start now and only join right before playback.
+    preparing = asyncio.create_task(prepare())
+    connecting = asyncio.create_task(connect_voice(guild, channel))
     try:
-        file_path = await audio_source.download(sounds[key], AUDIO_TMPDIR)
-        loudness = await get_volume(file_path)
-        audio_filter = filter_settings(loudness)
-        if not os.path.exists(file_path):
-            log.error(f"Audio file does not exist: {file_path}")
-            return await interaction.followup.send(
-                f"Error: Audio file for `{sounds[key]}` not found.",
-                ephemeral=True)
-
-        log.info(
-            f"Audio file exists: {file_path}, size={os.path.getsize(file_path)} bytes"
-        )
-        source = discord.PCMVolumeTransformer(
-            discord.FFmpegPCMAudio(source=file_path,
-                                   options=f"-af {audio_filter}"))
-        log.info(f"FFmpeg options: -af {audio_filter}")
+        with metrics.span('defer', guild_id):
+            await interaction.response.defer(ephemeral=True)
+        vc, (file_path, digest, audio_filter) = await asyncio.gather(
+            connecting, preparing)
+        assert isinstance(vc, discord.VoiceClient)
         log.info(f"Voice client connected: {vc.is_connected()}")
-        vc.play(source)
+
+        def on_first_packet():
+            metrics.observe('first_packet', time.perf_counter() - start,
+                            guild_id)
+
+        if mixing:
+            with metrics.span('source_start', guild_id):
+                await mix_into(guild, vc, file_path, audio_filter)
+            outcome = "playing"
+        else:
+            # Built when its turn comes, so a waiting play doesn't keep an
+            # ffmpeg process around.
+            async def make_source():
+                with metrics.span('source_start', guild_id):
+                    source = await make_audio_source(file_path, digest,
+                                                     audio_filter)
+                return FirstPacketTimer(source, on_first_packet)
+
+            outcome = play_queue(guild.id).submit(vc, make_source)
     except Exception as e:
         log.exception("Failed to play sound")
-        await interaction.followup.send(f"Error: {e}", ephemeral=True)
+        if interaction.response.is_done():
+            await interaction.followup.send(f"Error: {e}", ephemeral=True)
+        return
+    finally:
+        # Whichever side is still running after a failure or cancellation.
+        # A shared preparation carries on for its other waiters.
+        preparing.cancel()
+        connecting.cancel()
+
+    messages = {
+        "playing": f"Playing `{name}`.",
+        "queued": f"Queued `{name}`.",
+        "dropped": "Already playing a sound, try again when it's done.",
+    }
+    with metrics.span('followup', guild_id):
+        await interaction.followup.send(messages[outcome], ephemeral=True)
+
+
+# The guild's voice client in `channel`, connecting or moving there first.
+# Concurrent /plays in a guild share one handshake.
+async def connect_voice(guild, channel):
+    vc = guild.voice_client
+    if vc is not None and vc.channel == channel:
+        return vc
+
+    async def connect():
+        with metrics.span('voice_connect', guild.id):
+            vc = guild.voice_client
+            if vc is None:
+                return await channel.connect()
+            await vc.move_to(channel)
+            return vc
+
+    return await flights.run(('voice', guild.id), connect)
+
+
+def play_queue(guild_id):
+    if guild_id not in play_queues:
+        # Only pcm playback runs an ffmpeg process per sound.
+        slots = playback_slots if args.playback == 'pcm' else None
+        play_queues[guild_id] = PlayQueue(asyncio.get_running_loop(),
+                                          policy=args.play_policy,
+                                          max_size=args.play_queue_size,
+                                          slots=slots)
+    return play_queues[guild_id]
 
 
 async def join_voice_channel(interaction: discord.Interaction,
@@ -290,7 +600,7 @@ async def voice_channel_autocomplete(
     ]
 
 
-@tree.command(name='join', description="Join a specified voice channel")
+@app_commands.command(name='join', description="Join a specified voice channel")
 @app_commands.describe(channel='Voice channel to join')
 @app_commands.autocomplete(channel=voice_channel_autocomplete)
 async def join(interaction: discord.Interaction, channel: str):
@@ -301,6 +611,7 @@ async def join(interaction: discord.Interaction, channel: str):
                                                 ephemeral=True)
         return
     await interaction.response.defer(ephemeral=True)
+    lifecycle.touch(interaction.guild.id)
     try:
         await join_voice_channel(interaction, vc)
         log.info(f"Joined voice channel: {vc.name}")
@@ -312,7 +623,7 @@ async def join(interaction: discord.Interaction, channel: str):
             f"Failed to join {vc.name}. Error: {e}", ephemeral=True)
 
 
-@tree.command(name='summon', description="Join your current voice channel")
+@app_commands.command(name='summon', description="Join your current voice channel")
 async def summon(interaction: discord.Interaction):
     assert isinstance(interaction.user, discord.Member)
     if not interaction.user.voice or not interaction.user.voice.channel:
@@ -322,6 +633,7 @@ async def summon(interaction: discord.Interaction):
 
     channel = interaction.user.voice.channel
     await interaction.response.defer(ephemeral=True)
+    lifecycle.touch(channel.guild.id)
 
     assert isinstance(channel, discord.VoiceChannel)
     try:
@@ -335,13 +647,14 @@ async def summon(interaction: discord.Interaction):
         )
 
 
-@tree.command(name='leave', description="Leave any connected voice channel.")
+@app_commands.command(name='leave', description="Leave any connected voice channel.")
 async def leave(interaction: discord.Interaction):
     assert interaction.guild is not None
     vc = interaction.guild.voice_client
     assert isinstance(vc, discord.VoiceClient)
     if vc:
         channel = vc.channel
+        free_guild(interaction.guild.id)
         await vc.disconnect()
         await interaction.response.send_message(f"Leaving {channel}",
                                                 ephemeral=True)
@@ -350,12 +663,20 @@ async def leave(interaction: discord.Interaction):
             "I'm not in any voice channel on this server!", ephemeral=True)
 
 
-@tree.command(name='stop', description="Stop any currently playing sound.")
+@app_commands.command(name='stop', description="Stop any currently playing sound.")
 async def stop(interaction: discord.Interaction):
     assert interaction.guild is not None
     vc = interaction.guild.voice_client
     assert isinstance(vc, discord.VoiceClient)
-    if vc is not None and vc.is_playing():
+    queue = play_queues.get(interaction.guild.id)
+    # Also a play still waiting for a playback slot or being built, which
+    # would otherwise start after this.
+    if vc is not None and (vc.is_playing() or
+                           (queue is not None and queue.busy(vc))):
+        if interaction.guild.id in mixers:
+            mixers[interaction.guild.id].clear()
+        if interaction.guild.id in play_queues:
+            play_queues[interaction.guild.id].clear()
         vc.stop()
         await interaction.response.send_message("Stopped playing sound.",
                                                 ephemeral=True)
@@ -364,38 +685,436 @@ async def stop(interaction: discord.Interaction):
             "No sound is currently playing.", ephemeral=True)
 
 
-@bot.event
+@app_commands.command(name='stats',
+                      description="Show /play latency by stage.")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    msg = "All guilds:\n```\n" + metrics.render_text() + "\n```"
+    if interaction.guild_id is not None:
+        msg += "This server:\n```\n" + metrics.render_text(
+            interaction.guild_id) + "\n```"
+    await interaction.response.send_message(msg[:2000], ephemeral=True)
+
+
+def cache_counts():
+    counts = {
+        "sounds": len(sounds),
+        "loudness entries": len(loudness_cache),
+        "audio cache files": len(audio_source.entries),
+        "audio cache MiB": audio_source.total_bytes // (1024 * 1024),
+        "prefetches pending": len(prefetcher.pending),
+        "queued plays": sum(len(q) for q in play_queues.values()),
+        "mixers": len(mixers),
+    }
+    if bot is not None:
+        counts.update({
+            "guilds": len(bot.guilds),
+            "cached members": sum(len(g.members) for g in bot.guilds),
+            "cached messages": len(bot.cached_messages),
+            "voice clients": len(bot.voice_clients),
+        })
+    return counts
+
+
+@app_commands.command(name='memory',
+                      description="Show the bot's memory use.")
+@app_commands.default_permissions(administrator=True)
+async def memory(interaction: discord.Interaction):
+    report = await asyncio.to_thread(render_report, cache_counts())
+    await interaction.response.send_message(f"```\n{report}\n```"[:2000],
+                                            ephemeral=True)
+
+
+# Per-guild state that only matters while connected to voice.
+def free_guild(guild_id):
+    lifecycle.forget(guild_id)
+    mixers.pop(guild_id, None)
+    queue = play_queues.pop(guild_id, None)
+    if queue is not None:
+        queue.clear()
+
+
+def guild_busy(guild_id):
+    guild = bot.get_guild(guild_id)
+    vc = guild.voice_client if guild is not None else None
+    mixer = mixers.get(guild_id)
+    queue = play_queues.get(guild_id)
+    return bool((vc is not None and vc.is_playing()) or
+                (mixer is not None and mixer.active) or
+                (queue is not None and queue.starting is not None))
+
+
+async def release_idle_guild(guild_id):
+    guild = bot.get_guild(guild_id)
+    free_guild(guild_id)
+    if guild is not None and guild.voice_client is not None:
+        log.info(f"Leaving idle voice channel in guild {guild_id}")
+        await guild.voice_client.disconnect()
+
+
+async def reap_idle_voice(interval):
+    await lifecycle.reap(release_idle_guild, guild_busy, interval,
+                         lambda: [vc.guild.id for vc in bot.voice_clients])
+
+
+# Kicked, moved out of a deleted channel, or disconnected some other way.
+async def on_voice_state_update(member, before, after):
+    if (after.channel is None and bot.user is not None
+            and member.id == bot.user.id):
+        free_guild(member.guild.id)
+
+
 async def on_disconnect():
     log.warning("Gateway connection lost.")
 
 
-@bot.event
 async def on_resumed():
     log.info("Gateway connection resumed.")
 
 
-@bot.event
-async def on_ready():
-    sound_list = audio_source.list_sounds()
+def catalog_path():
+    return os.path.join(args.cache_dir, "catalog.json")
+
+
+def set_catalog(sound_list, versions=None):
     sounds.clear()
     sounds.update((depunctuate(s), s) for s in sound_list)
+    sound_index.rebuild(sounds)
+    catalog.reset(sound_list)
+    if versions is not None:
+        catalog.update(versions)
+
+
+def load_cached_catalog():
+    try:
+        with open(catalog_path()) as f:
+            sound_list = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        log.exception("Ignoring unreadable cached catalog")
+        return
+    set_catalog(sound_list)
+    log.info(f"Serving {len(sounds)} sounds from cached catalog.")
+
+
+def save_cached_catalog(sound_list):
+    write_atomic(catalog_path(), json.dumps(sound_list).encode())
+
+
+async def load_catalog():
+    manifest = await load_source_manifest(audio_source, audio_source.cache_dir)
+    if manifest is not None:
+        sound_list = list(manifest["sounds"])
+        for entry in manifest["sounds"].values():
+            loudness_cache.put(entry["sha256"], entry["loudness"])
+        log.info(f"Loaded loudness for {len(sound_list)} sounds from manifest.")
+        versions = None
+    else:
+        versions = object_versions(await audio_source.list_objects())
+        sound_list = list(versions)
+    set_catalog(sound_list, versions)
     log.info(
         f'Found {len(sounds)} sounds in {"local dir" if args.mock_audio else "S3"}.'
     )
+    if args.cached_catalog:
+        save_cached_catalog(sound_list)
+    if args.prefetch:
+        prefetcher.request([s for s in prefetcher.hot(10) if s in sound_list])
+
+
+# Relist the source and apply only what changed, so uploads show up (and
+# deletions disappear) without a restart or a full rebuild of the index.
+async def refresh_catalog():
+    added, removed, changed = catalog.update(
+        object_versions(await audio_source.list_objects()))
+    for name in removed:
+        key = depunctuate(name)
+        if sounds.get(key) == name:
+            del sounds[key]
+            sound_index.remove(key)
+    for name in added:
+        key = depunctuate(name)
+        sounds[key] = name
+        sound_index.add(key)
+    await audio_source.discard(*removed, *changed)
+    if added or removed or changed:
+        log.info(f"Catalog refresh: {len(added)} added, {len(removed)} "
+                 f"removed, {len(changed)} changed.")
+    if (added or removed) and args.cached_catalog:
+        save_cached_catalog(list(catalog.versions))
+
+
+async def refresh_catalog_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_catalog()
+        except Exception:
+            log.exception("Catalog refresh failed")
+
+
+def snapshot_store():
+    # One file per process; shards of a sharded deployment differ in which
+    # guilds they are connected to.
+    name = "snapshot.json"
+    if args.shard_ids:
+        name = f"snapshot-{'-'.join(map(str, args.shard_ids))}.json"
+    if args.snapshot_store == 'bucket' and not args.mock_audio:
+        return S3BlobStore(bucket_source(), name)
+    return LocalBlobStore(os.path.join(args.cache_dir, name))
+
+
+def snapshot_state():
+    return {
+        "catalog": catalog.versions,
+        "loudness": loudness_cache.entries,
+        "hot_audio": list(audio_source.entries)[-SNAPSHOT_WARM:],
+        "recent": list(prefetcher.recent),
+        "counts": dict(prefetcher.counts),
+        "voice": [[vc.guild.id, vc.channel.id] for vc in bot.voice_clients
+                  if vc.channel is not None],
+    }
+
+
+def restore_state(state):
+    global restored_voice
+    versions = {
+        name: tuple(version) if version is not None else None
+        for name, version in state.get("catalog", {}).items()
+    }
+    if versions:
+        set_catalog(list(versions), versions)
+    for key, loudness in state.get("loudness", {}).items():
+        loudness_cache.entries.setdefault(key, loudness)
+    prefetcher.recent.extend(state.get("recent", []))
+    prefetcher.counts.update(state.get("counts", {}))
+    restored_voice = state.get("voice", [])
+    if args.prefetch:
+        hot = state.get("hot_audio", []) + prefetcher.hot(10)
+        prefetcher.request([s for s in dict.fromkeys(hot) if s in catalog.versions])
+    log.info(f"Restored {len(sounds)} sounds, {len(loudness_cache)} loudness "
+             f"entries and {len(restored_voice)} voice channels from snapshot.")
+
+
+async def load_snapshot():
+    try:
+        data = await snapshot_store().load()
+    except Exception:
+        log.exception("Couldn't read snapshot")
+        return False
+    state = parse_snapshot(data, args.snapshot_max_age) if data else None
+    if state is None:
+        return False
+    restore_state(state)
+    return True
+
+
+async def save_snapshot():
+    data = dump_snapshot(snapshot_state())
+    await asyncio.wait_for(snapshot_store().save(data), SNAPSHOT_TIMEOUT)
+    log.info(f"Saved snapshot of {len(catalog)} sounds and "
+             f"{len(bot.voice_clients)} voice channels.")
+
+
+# Go back to the voice channels we were in before the restart.
+async def rejoin_voice(channels):
+    for guild_id, channel_id in channels:
+        channel = bot.get_channel(channel_id)
+        if not isinstance(channel, discord.VoiceChannel):
+            continue
+        if channel.guild.voice_client is not None:
+            continue
+        try:
+            await connect_voice(channel.guild, channel)
+            lifecycle.touch(guild_id)
+        except Exception:
+            log.exception(f"Failed to rejoin voice channel {channel_id}")
+
+
+# Snapshot while still connected, so the voice channels are known, then shut
+# down as discord.py would on Ctrl-C.
+async def shutdown():
+    try:
+        await save_snapshot()
+    except Exception:
+        log.exception("Failed to save snapshot")
+    await bot.close()
+
+
+def install_shutdown_handler():
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM,
+                                lambda: start_background(shutdown()))
+    except NotImplementedError:
+        # No loop signal handlers on Windows.
+        pass
+
+
+async def setup_hook():
+    # Runs before the gateway connects, so listing overlaps with login.
+    restored = False
+    if args.snapshot_store != 'none':
+        restored = await load_snapshot()
+        install_shutdown_handler()
+    if args.cached_catalog and not restored:
+        load_cached_catalog()
+    start_background(load_catalog())
+    if args.catalog_refresh > 0:
+        start_background(refresh_catalog_periodically(args.catalog_refresh))
+    if args.voice_idle_timeout > 0:
+        start_background(
+            reap_idle_voice(min(60, max(1, args.voice_idle_timeout / 4))))
+    if args.metrics_port:
+        await start_http_server(metrics, args.metrics_host, args.metrics_port)
+
+
+def log_task_failure(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Background task failed", exc_info=task.exception())
+
+
+# The loop only keeps weak references to tasks.
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(log_task_failure)
+    return task
+
+
+async def on_ready():
     assert bot.user is not None
     log.info('Logged in as')
     log.info(f'{bot.user.name=}')
     log.info(f'{bot.user.id}')
     log.info('--------------------------------------------')
 
+    global restored_voice
+    if restored_voice:
+        start_background(rejoin_voice(restored_voice))
+        restored_voice = []
+
+    # on_ready fires again after every reconnect; the tree can't have
+    # changed since.
+    global commands_synced
+    if commands_synced or args.command_sync == 'never':
+        return
+    # Commands are global, so one worker of a sharded deployment is enough.
+    if args.shard_ids and 0 not in args.shard_ids:
+        return
+    guild = guild_obj()
+    if guild is not None:
+        bot.tree.copy_global_to(guild=guild)
+    scope = f"guild {guild.id}" if guild is not None else "global"
     try:
-        # Register commands globally
-        synced = await bot.tree.sync()
-        log.info(f"Synced {len(synced)} global commands.")
+        if args.command_sync == 'always':
+            synced = await bot.tree.sync(guild=guild)
+        else:
+            synced = await sync_if_changed(bot.tree, fingerprint_store(),
+                                           bot.application_id, guild)
+        commands_synced = True
+        if synced is not None:
+            log.info(f"Synced {len(synced)} {scope} commands.")
     except Exception as e:
         log.error(f"Failed to sync commands: {e}")
 
 
-if __name__ == '__main__':
+def fingerprint_store():
+    if args.command_sync_store == 'bucket' and not args.mock_audio:
+        return S3BlobStore(bucket_source(), FINGERPRINT_NAME)
+    return LocalBlobStore(os.path.join(args.cache_dir, FINGERPRINT_NAME))
+
+
+COMMANDS = [list_sounds, play, join, summon, leave, stop, stats, memory]
+
+
+def create_bot(args):
+    options = {}
+    if args.low_memory:
+        # Slash commands only need guilds, and voice states to find the
+        # caller's channel. No message cache and no member list beyond who is
+        # in voice.
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.voice_states = True
+        options = dict(max_messages=None,
+                       member_cache_flags=discord.MemberCacheFlags.from_intents(
+                           intents),
+                       chunk_guilds_at_startup=False)
+    else:
+        intents = discord.Intents.default()
+        intents.guild_messages = True
+        intents.dm_messages = True
+        intents.message_content = True
+        intents.messages = True
+        intents.voice_states = True
+
+    description = 'Kernels of wisdom from fighter pilot legends.'
+    if args.shard_count:
+        bot = commands.AutoShardedBot(intents=intents,
+                                      command_prefix='!co-',
+                                      description=description,
+                                      shard_count=args.shard_count,
+                                      shard_ids=args.shard_ids,
+                                      **options)
+    else:
+        bot = commands.Bot(intents=intents,
+                           command_prefix='!co-',
+                           description=description,
+                           **options)
+    for command in COMMANDS:
+        bot.tree.add_command(command)
+    for event in (on_disconnect, on_resumed, on_ready, on_voice_state_update):
+        bot.event(event)
+    bot.setup_hook = setup_hook
+    return bot
+
+
+# Takes argv, or options already parsed from it.
+def init(argv=None, options=None):
+    global args, bot, audio_source, loudness_cache, opus_cache, prefetcher
+    global ffmpeg_slots, playback_slots, lifecycle, s3_bucket
+    args = options if options is not None else parse_args(argv)
+    s3_bucket = None
+    if args.tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if args.low_memory:
+        sound_index.cache_size = 64
+        metrics.max_guilds = 20
+        metrics.window = 256
+    ffmpeg_slots = asyncio.Semaphore(args.ffmpeg_jobs)
+    playback_slots = asyncio.Semaphore(args.playback_jobs)
+    lifecycle = VoiceLifecycle(args.voice_idle_timeout)
+    audio_source = CachedAudioSource(get_audio_source(args),
+                                     os.path.join(args.cache_dir, "audio"),
+                                     max_bytes=args.audio_cache_mb * 1024 * 1024,
+                                     max_age=args.audio_cache_max_age)
+    loudness_cache = LoudnessCache(
+        os.path.join(args.cache_dir, "loudness.json"))
+    loudness_cache.load()
+    opus_cache = OpusCache(os.path.join(args.cache_dir, "opus"),
+                           limit=ffmpeg_slots,
+                           max_bytes=args.opus_cache_mb * 1024 * 1024)
+    prefetcher = Prefetcher(warm_sound, concurrency=args.prefetch_concurrency)
+    bot = create_bot(args)
+    return bot
+
+
+def main(argv=None):
+    # Logging first, so what init() logs while loading caches is kept.
+    options = parse_args(argv)
+    setup_logging(options.log_levels,
+                  fmt=options.log_format,
+                  rate=options.log_rate,
+                  burst=options.log_burst)
+    init(options=options)
+    log_discordpy_version()
     token = os.environ['DISCORD_TOKEN']
-    bot.run(token)
+    # Our handlers are already installed; don't let discord.py add its own.
+    bot.run(token, log_handler=None)
+
+
+if __name__ == '__main__':
+    main()
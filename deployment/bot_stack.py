@@ -26,6 +26,10 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+# Built by `python -m cobot.bundle` before deploying (see the deploy workflow).
+BUNDLE_DIR = "./build/bundle"
+BUNDLE_NAME = "sounds.bundle"
+
 
 class CoBotStack(Stack):
     def __init__(
@@ -46,10 +50,12 @@ class CoBotStack(Stack):
             auto_delete_objects=True,
         )
 
+        # One object for the whole library, so the bot starts with a single
+        # GET instead of a LIST plus a GET per sound.
         s3deploy.BucketDeployment(
             self,
             "DeployAudio",
-            sources=[s3deploy.Source.asset("./sounds")],
+            sources=[s3deploy.Source.asset(BUNDLE_DIR)],
             destination_bucket=audio_bucket,
         )
 
@@ -151,6 +157,12 @@ class CoBotStack(Stack):
             ),
             environment={
                 "AUDIO_BUCKET": audio_bucket.bucket_name,
+                "COBOT_PLAYBACK": "passthrough",
+                "COBOT_LOW_MEMORY": "1",
+                "COBOT_AUDIO_BUNDLE": BUNDLE_NAME,
+                "COBOT_COMMAND_SYNC_STORE": "bucket",
+                # Spot interruptions replace the task and its disk.
+                "COBOT_SNAPSHOT_STORE": "bucket",
             },
             secrets={
                 "DISCORD_TOKEN": ecs.Secret.from_secrets_manager(
@@ -174,4 +186,9 @@ class CoBotStack(Stack):
         )
 
         audio_bucket.grant_read(task_definition.task_role)
+        # Fingerprint of the last slash command sync. Each deploy prunes it
+        # from the bucket, so the first start after a deploy always syncs.
+        audio_bucket.grant_put(task_definition.task_role, "commands.sha256")
+        # State saved on SIGTERM for the replacement task (see cobot.snapshot).
+        audio_bucket.grant_put(task_definition.task_role, "snapshot*.json")
         bot_token_secret.grant_read(task_definition.task_role)
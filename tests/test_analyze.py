@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from cobot.analyze import (MANIFEST_VERSION, load_manifest,
+                           load_source_manifest, write_manifest)
+from cobot.audio_source import MANIFEST_NAME, LocalAudioSource
+from cobot.loudness import parse_duration
+
+MANIFEST = {
+    "version": MANIFEST_VERSION,
+    "sounds": {
+        "hello": {
+            "sha256": "abc",
+            "size": 10,
+            "duration": 1.5,
+            "loudness": {
+                "input_i": "-20.0",
+                "input_tp": "-3.0",
+                "input_lra": "2.0",
+                "input_thresh": "-30.0",
+            },
+        },
+    },
+}
+
+
+def test_parse_duration():
+    assert parse_duration("  Duration: 00:01:02.50, start: 0") == 62.5
+    assert parse_duration("no duration here") is None
+
+
+def test_manifest_roundtrip(tmp_path):
+    path = str(tmp_path / MANIFEST_NAME)
+    write_manifest(MANIFEST, path)
+    assert load_manifest(path) == MANIFEST
+
+
+def test_manifest_rejects_unknown_version(tmp_path):
+    path = tmp_path / MANIFEST_NAME
+    path.write_text(json.dumps({"version": 999, "sounds": {}}))
+    with pytest.raises(ValueError):
+        load_manifest(str(path))
+
+
+@pytest.mark.asyncio
+async def test_load_source_manifest(tmp_path):
+    source = LocalAudioSource(audio_dir=str(tmp_path))
+    assert await load_source_manifest(source, str(tmp_path)) is None
+
+    write_manifest(MANIFEST, str(tmp_path / MANIFEST_NAME))
+    assert await load_source_manifest(source, str(tmp_path)) == MANIFEST
@@ -0,0 +1,201 @@
+import asyncio
+import io
+import os
+import threading
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from cobot.audio_source import (CachedAudioSource, LocalAudioSource,
+                                NotModified, S3AudioSource)
+
+
+@pytest.fixture
+def sound_dir(tmp_path):
+    d = tmp_path / 'sounds'
+    d.mkdir()
+    for name, size in [('alpha', 100), ('bravo', 100), ('charlie', 100)]:
+        (d / f'{name}.ogg').write_bytes(b'x' * size)
+    return d
+
+
+# A local directory that pretends to be remote, so it goes through the cache.
+class RemoteDirSource(LocalAudioSource):
+
+    def local_path(self, sound_name):
+        return None
+
+
+def make_cache(tmp_path, sound_dir, **kwargs):
+    kwargs.setdefault('max_bytes', 1000)
+    return CachedAudioSource(RemoteDirSource(str(sound_dir)),
+                             str(tmp_path / 'cache'), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_local_fetch_not_modified(sound_dir, tmp_path):
+    source = LocalAudioSource(str(sound_dir))
+    etag = await source.fetch('alpha', str(tmp_path / 'out.ogg'))
+    with pytest.raises(NotModified):
+        await source.fetch('alpha', str(tmp_path / 'out.ogg'), etag)
+
+
+@pytest.mark.asyncio
+async def test_local_source_is_played_in_place(sound_dir, tmp_path):
+    cache = CachedAudioSource(LocalAudioSource(str(sound_dir)),
+                              str(tmp_path / 'cache'), max_bytes=1000)
+    path = await cache.download('alpha')
+    assert path == str(sound_dir / 'alpha.ogg')
+    assert not cache.entries
+    assert not os.path.exists(cache.path_for('alpha'))
+    with pytest.raises(FileNotFoundError):
+        await cache.download('missing')
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_backend(sound_dir, tmp_path):
+    cache = make_cache(tmp_path, sound_dir)
+    path = await cache.download('alpha')
+    assert open(path, 'rb').read() == b'x' * 100
+
+    cache.source.fetch = AsyncMock()
+    assert await cache.download('alpha') == path
+    cache.source.fetch.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_revalidates_with_etag(sound_dir, tmp_path):
+    cache = make_cache(tmp_path, sound_dir, max_age=0)
+    await cache.download('alpha')
+    etag = cache.entries['alpha']['etag']
+
+    cache.source.fetch = AsyncMock(side_effect=NotModified('alpha'))
+    path = await cache.download('alpha')
+    cache.source.fetch.assert_awaited_once()
+    assert cache.source.fetch.await_args.args[2] == etag
+    assert os.path.exists(path)
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_respects_budget(sound_dir, tmp_path):
+    cache = make_cache(tmp_path, sound_dir, max_bytes=250)
+    await cache.download('alpha')
+    await cache.download('bravo')
+    await cache.download('alpha')
+    await cache.download('charlie')
+
+    assert list(cache.entries) == ['alpha', 'charlie']
+    assert cache.total_bytes <= 250
+    assert not os.path.exists(cache.path_for('bravo'))
+
+
+@pytest.mark.asyncio
+async def test_index_survives_restart(sound_dir, tmp_path):
+    cache = make_cache(tmp_path, sound_dir)
+    await cache.download('alpha')
+
+    reopened = make_cache(tmp_path, sound_dir)
+    assert 'alpha' in reopened.entries
+
+
+@pytest.fixture
+def s3_source():
+    with patch('boto3.client', return_value=MagicMock()):
+        yield S3AudioSource('bucket')
+
+
+@pytest.mark.asyncio
+async def test_s3_list_sounds_paginates(s3_source):
+    pages = [
+        {'Contents': [{'Key': f'clip{i}.ogg'} for i in range(1000)]},
+        {'Contents': [{'Key': 'last.ogg'}, {'Key': 'manifest.json'}]},
+    ]
+    s3_source.s3.get_paginator.return_value.paginate.return_value = pages
+    names = await s3_source.list_sounds()
+    assert len(names) == 1001
+    assert names[-1] == 'last'
+
+
+@pytest.mark.asyncio
+async def test_s3_fetch_runs_off_the_event_loop(s3_source, tmp_path):
+    threads = []
+
+    def get_object(**kwargs):
+        threads.append(threading.current_thread().name)
+        return {'Body': io.BytesIO(b'ogg'), 'ETag': '"abc"'}
+
+    s3_source.s3.get_object.side_effect = get_object
+    dest = tmp_path / 'clip.ogg'
+    assert await s3_source.fetch('clip', str(dest)) == '"abc"'
+    assert dest.read_bytes() == b'ogg'
+    assert threads[0].startswith('cobot-s3')
+
+
+@pytest.mark.asyncio
+async def test_shared_directory_reuses_sibling_fetches(sound_dir, tmp_path):
+    first = make_cache(tmp_path, sound_dir)
+    second = make_cache(tmp_path, sound_dir)
+    await first.download('alpha')
+
+    fetch = second.source.fetch
+    second.source.fetch = AsyncMock()
+    await second.download('alpha')
+    second.source.fetch.assert_not_awaited()
+
+    second.source.fetch = fetch
+    await second.download('bravo')
+    assert set(first._read_index()) == {'alpha', 'bravo'}
+
+
+@pytest.mark.asyncio
+async def test_s3_client_is_built_off_the_event_loop(tmp_path):
+    threads = []
+
+    def client(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return MagicMock()
+
+    with patch('boto3.client', side_effect=client):
+        s3_source = S3AudioSource('bucket')
+        await s3_source.download('clip', str(tmp_path))
+    assert len(threads) == 1
+    assert threads[0].startswith('cobot-s3')
+
+
+@pytest.mark.asyncio
+async def test_index_is_written_off_the_event_loop(sound_dir, tmp_path):
+    cache = make_cache(tmp_path, sound_dir)
+    write = cache._write_index
+    threads = []
+
+    def write_index(items):
+        threads.append(threading.current_thread())
+        write(items)
+
+    cache._write_index = write_index
+    await cache.download('alpha')
+    await cache.download('bravo')
+    await cache.discard('alpha', 'bravo', 'charlie')
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
+    assert not cache.entries
+    assert not cache._read_index()
+
+
+@pytest.mark.asyncio
+async def test_index_keeps_sibling_fetches_written_meanwhile(sound_dir, tmp_path):
+    first = make_cache(tmp_path, sound_dir)
+    second = make_cache(tmp_path, sound_dir)
+    write = first._write_index
+
+    async def sibling_fetch():
+        await second.download('bravo')
+
+    def write_index(items):
+        # The sibling saves between our read and our write.
+        asyncio.run(sibling_fetch())
+        write(items)
+
+    first._write_index = write_index
+    await first.download('alpha')
+    assert set(first._read_index()) == {'alpha', 'bravo'}
@@ -0,0 +1,74 @@
+import os
+
+from cobot.autocomplete import SoundIndex, depunctuate, trigrams
+
+SOUND_DIR = os.path.join(os.path.dirname(__file__), '..', 'sounds')
+
+
+def real_sounds():
+    names = sorted(os.path.splitext(f)[0] for f in os.listdir(SOUND_DIR)
+                   if f.endswith('.ogg'))
+    return {depunctuate(n): n for n in names}
+
+
+def test_trigrams():
+    assert trigrams('hello') == {'hel', 'ell', 'llo'}
+    assert trigrams('hi') == set()
+
+
+def test_top_prefers_best_match():
+    index = SoundIndex({'hello': 'hello', 'world': 'world', 'help': 'help'})
+    assert index.top('Hell-o!', 1) == ['hello']
+    assert len(index.top('he', 20)) == 3
+
+
+def test_empty_query_returns_first_k():
+    sounds = real_sounds()
+    index = SoundIndex(sounds)
+    assert index.top('', 5) == list(sounds)[:5]
+
+
+def test_shortlist_finds_exact_match_in_large_library():
+    sounds = {f'filler{i:05d}': f'filler{i:05d}' for i in range(5000)}
+    sounds.update(real_sounds())
+    index = SoundIndex(sounds, max_candidates=50)
+    assert index.top('batman', 20)[0] == 'batman'
+    assert index.top('dead elephant', 20)[0] == '13deadelephant'
+
+
+def test_large_library_never_scores_every_key(monkeypatch):
+    sounds = {f'filler{i:05d}': f'filler{i:05d}' for i in range(5000)}
+    sounds.update(real_sounds())
+    index = SoundIndex(sounds, max_candidates=50)
+    scored = []
+    monkeypatch.setattr('cobot.autocomplete.fuzz.partial_ratio',
+                        lambda q, k: scored.append(k) or 0)
+    assert index.top('xyzzy', 20) == []
+    assert scored == []
+    index.top('b', 20)
+    index.top('ba', 20)
+    assert len(scored) <= 100
+    assert index.top('ba', 1)[0].startswith('ba')
+
+
+def test_results_are_cached_and_cleared_on_rebuild():
+    index = SoundIndex({'hello': 'hello'}, cache_size=2)
+    assert index.top('hel', 20) == ['hello']
+    index.top('a', 20)
+    index.top('b', 20)
+    assert len(index._cache) == 2
+
+    index.rebuild({'world': 'world'})
+    assert index.top('hel', 20) == ['world']
+
+
+def test_incremental_add_and_remove_match_rebuild():
+    sounds = {f'filler{i:05d}': f'filler{i:05d}' for i in range(500)}
+    index = SoundIndex(sounds, max_candidates=50)
+    index.top('batman', 5)
+    index.add('batman')
+    assert index.top('batman', 5)[0] == 'batman'
+    index.remove('batman')
+    assert 'batman' not in index.top('batman', 5)
+    assert index.grams == SoundIndex(sounds).grams
+    assert index.prefixes == SoundIndex(sounds).prefixes
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock, patch
+
+from cobot.audio_source import S3AudioSource
+from cobot.blobstore import LocalBlobStore, S3BlobStore
+
+
+@pytest.mark.asyncio
+async def test_local_store_roundtrip(tmp_path):
+    store = LocalBlobStore(str(tmp_path / 'cache' / 'snapshot.json'))
+    assert await store.load() is None
+    await store.save(b'{}')
+    assert await store.load() == b'{}'
+    await store.save(b'[]')
+    assert await store.load() == b'[]'
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == ['snapshot.json']
+
+
+@pytest.mark.asyncio
+async def test_s3_store_roundtrip():
+    with patch('boto3.client', return_value=MagicMock()):
+        s3_source = S3AudioSource('bucket')
+        stored = {}
+
+        def get_object(Bucket, Key):
+            if Key not in stored:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return {'Body': io.BytesIO(stored[Key])}
+
+        def put_object(Bucket, Key, Body):
+            stored[Key] = Body
+
+        s3_source.s3.get_object.side_effect = get_object
+        s3_source.s3.put_object.side_effect = put_object
+        store = S3BlobStore(s3_source, 'commands.sha256')
+        assert await store.load() is None
+        await store.save(b'abc')
+        assert await store.load() == b'abc'
+        assert stored == {'commands.sha256': b'abc'}
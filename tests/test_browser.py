@@ -0,0 +1,81 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from cobot.browser import (PAGE_CHARS, PageCache, SoundBrowser,
+                           chunk_strings_into, render_pages)
+
+NAMES = [f"sound-number-{i:04d}" for i in range(500)]
+
+
+def interaction():
+    i = MagicMock()
+    i.response.edit_message = AsyncMock()
+    i.response.send_modal = AsyncMock()
+    return i
+
+
+def test_chunk_strings_into_respects_size():
+    chunks = chunk_strings_into(['aaaa', 'bbbb', 'cccc'], 10)
+    assert chunks == [['aaaa', 'bbbb'], ['cccc']]
+
+
+def test_pages_fit_in_a_message():
+    pages = render_pages(NAMES)
+    assert len(pages) > 1
+    assert all(len(page) <= PAGE_CHARS + 8 for page in pages)
+    assert sum(page.count('sound-number') for page in pages) == len(NAMES)
+
+
+def test_page_cache_renders_once_per_generation():
+    cache = PageCache()
+    first = cache.get(1, reversed(NAMES))
+    assert cache.get(1, []) is first
+    assert first[0].startswith("```\nsound-number-0000")
+    assert cache.get(2, ['only']) == ["```\nonly\n```"]
+
+
+@pytest.mark.asyncio
+async def test_browser_pages_forward_and_back():
+    browser = SoundBrowser(render_pages(NAMES), search=lambda q: [])
+    assert browser.previous_page.disabled
+    assert "Page 1/" in browser.content()
+
+    i = interaction()
+    await browser.next_page.callback(i)
+    assert browser.page == 1
+    assert not browser.previous_page.disabled
+    assert "Page 2/" in i.response.edit_message.call_args.kwargs['content']
+
+    await browser.previous_page.callback(interaction())
+    assert browser.page == 0
+
+
+@pytest.mark.asyncio
+async def test_browser_filter_and_clear():
+    all_pages = render_pages(NAMES)
+    search = MagicMock(return_value=['sound-number-0042'])
+    browser = SoundBrowser(all_pages, search=search)
+    await browser.next_page.callback(interaction())
+
+    browser.set_filter('42')
+    search.assert_called_once_with('42')
+    assert browser.page == 0
+    assert browser.next_page.disabled
+    assert 'sound-number-0042' in browser.content()
+    assert "matching `42`" in browser.content()
+
+    search.return_value = []
+    browser.set_filter('zzz')
+    assert browser.content() == "No sounds match `zzz`."
+
+    await browser.clear_filter.callback(interaction())
+    assert browser.pages is all_pages
+    assert browser.clear_filter.disabled
+
+
+@pytest.mark.asyncio
+async def test_filter_button_opens_modal():
+    browser = SoundBrowser(render_pages(NAMES), search=lambda q: [])
+    i = interaction()
+    await browser.filter.callback(i)
+    i.response.send_modal.assert_awaited_once()
@@ -0,0 +1,143 @@
+import io
+import json
+import shutil
+
+import pytest
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock, patch
+
+from cobot.audio_source import CachedAudioSource, NotModified, S3AudioSource
+from cobot.bundle import (BundleAudioSource, FileBundleReader, S3BundleReader,
+                          build_bundle)
+from cobot.catalog import Catalog, object_versions
+
+MANIFEST = {"version": 1, "sounds": {"alpha": {"loudness": {}}}}
+
+
+@pytest.fixture
+def bundle_path(tmp_path):
+    d = tmp_path / 'sounds'
+    d.mkdir()
+    for name, data in [('alpha', b'a' * 100), ('bravo', b'bb' * 70)]:
+        (d / f'{name}.ogg').write_bytes(data)
+    (d / 'notes.txt').write_text('not a sound')
+    path = tmp_path / 'sounds.bundle'
+    build_bundle(str(d), str(path), MANIFEST)
+    return path
+
+
+@pytest.fixture
+def s3_source():
+    with patch('boto3.client', return_value=MagicMock()):
+        yield S3AudioSource('bucket')
+
+
+def serve(s3_source, path):
+    data = path.read_bytes()
+    ranges = []
+
+    def get_object(Bucket, Key, Range, IfMatch):
+        assert IfMatch == '"v1"'
+        start, end = (int(n) for n in Range[len('bytes='):].split('-'))
+        ranges.append((start, end))
+        return {'Body': io.BytesIO(data[start:end + 1])}
+
+    s3_source.s3.head_object.return_value = {'ETag': '"v1"'}
+    s3_source.s3.get_object.side_effect = get_object
+    s3_source.s3.download_file.side_effect = (
+        lambda bucket, key, dest: shutil.copyfile(path, dest))
+    return ranges
+
+
+@pytest.mark.asyncio
+async def test_local_bundle_roundtrip(bundle_path, tmp_path):
+    source = BundleAudioSource(FileBundleReader(str(bundle_path)))
+    assert sorted(await source.list_sounds()) == ['alpha', 'bravo']
+    assert await source.read('bravo') == b'bb' * 70
+
+    dest = tmp_path / 'out.ogg'
+    etag = await source.fetch('alpha', str(dest))
+    assert dest.read_bytes() == b'a' * 100
+    with pytest.raises(NotModified):
+        await source.fetch('alpha', str(dest), etag)
+    with pytest.raises(FileNotFoundError):
+        await source.read('charlie')
+
+    manifest = await source.download_manifest(str(tmp_path))
+    with open(manifest) as f:
+        assert json.load(f) == MANIFEST
+
+
+@pytest.mark.asyncio
+async def test_rebuilt_bundle_is_reloaded(bundle_path, tmp_path):
+    source = BundleAudioSource(FileBundleReader(str(bundle_path)))
+    await source.list_objects()
+    d = tmp_path / 'sounds'
+    (d / 'charlie.ogg').write_bytes(b'c' * 10)
+    build_bundle(str(d), str(bundle_path))
+    assert len(await source.list_objects()) == 3
+    assert await source.read('charlie') == b'c' * 10
+
+
+@pytest.mark.asyncio
+async def test_rebuild_only_changes_the_clips_that_differ(bundle_path,
+                                                           tmp_path):
+    source = BundleAudioSource(FileBundleReader(str(bundle_path)))
+    catalog = Catalog()
+    catalog.update(object_versions(await source.list_objects()))
+    (tmp_path / 'sounds' / 'bravo.ogg').write_bytes(b'B' * 70)
+    build_bundle(str(tmp_path / 'sounds'), str(bundle_path))
+    assert catalog.update(object_versions(await source.list_objects())) == (
+        [], [], ['bravo'])
+
+
+@pytest.mark.asyncio
+async def test_s3_ranged_read_reloads_a_replaced_bundle(bundle_path,
+                                                        s3_source, tmp_path):
+    serve(s3_source, bundle_path)
+    source = BundleAudioSource(S3BundleReader(s3_source, 'sounds.bundle',
+                                              '/unused', whole=False))
+    await source.list_objects()
+
+    # Replace the bundle with one where bravo sits at a different offset.
+    (tmp_path / 'sounds' / 'alpha.ogg').write_bytes(b'a' * 30)
+    build_bundle(str(tmp_path / 'sounds'), str(bundle_path))
+    data = bundle_path.read_bytes()
+
+    def get_object(Bucket, Key, Range, IfMatch):
+        if IfMatch != '"v2"':
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}},
+                              'GetObject')
+        start, end = (int(n) for n in Range[len('bytes='):].split('-'))
+        return {'Body': io.BytesIO(data[start:end + 1])}
+
+    s3_source.s3.head_object.return_value = {'ETag': '"v2"'}
+    s3_source.s3.get_object.side_effect = get_object
+    assert await source.read('bravo') == b'bb' * 70
+
+
+@pytest.mark.asyncio
+async def test_s3_ranged_reads_one_clip(bundle_path, s3_source):
+    ranges = serve(s3_source, bundle_path)
+    source = BundleAudioSource(S3BundleReader(s3_source, 'sounds.bundle',
+                                              '/unused', whole=False))
+    await source.list_objects()
+    assert await source.read('bravo') == b'bb' * 70
+    start, end = ranges[-1]
+    assert end - start + 1 == 140
+    s3_source.s3.download_file.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_s3_whole_bundle_is_one_download(bundle_path, s3_source,
+                                               tmp_path):
+    serve(s3_source, bundle_path)
+    source = BundleAudioSource(S3BundleReader(s3_source, 'sounds.bundle',
+                                              str(tmp_path / 'cache')))
+    cached = CachedAudioSource(source, str(tmp_path / 'audio'), max_bytes=1000)
+    path = await cached.download('alpha')
+    with open(path, 'rb') as f:
+        assert f.read() == b'a' * 100
+    await cached.list_objects()
+    s3_source.s3.download_file.assert_called_once()
+    s3_source.s3.get_object.assert_not_called()
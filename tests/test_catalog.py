@@ -0,0 +1,35 @@
+from cobot.catalog import Catalog, object_versions
+
+
+def listing(**etags):
+    return object_versions([{
+        'Key': f'{name}.ogg',
+        'ETag': etag,
+        'LastModified': '2024-01-01'
+    } for name, etag in etags.items()])
+
+
+def test_update_reports_only_differences():
+    catalog = Catalog()
+    assert catalog.update(listing(a='1', b='1')) == (['a', 'b'], [], [])
+    assert catalog.update(listing(a='1', b='2', c='1')) == (['c'], [], ['b'])
+    assert catalog.update(listing(b='2', c='1')) == ([], ['a'], [])
+    assert catalog.update(listing(b='2', c='1')) == ([], [], [])
+
+
+def test_names_without_versions_are_not_changed():
+    catalog = Catalog()
+    catalog.reset(['a', 'b'])
+    assert catalog.update(listing(a='1', b='1')) == ([], [], [])
+    assert len(catalog) == 2
+
+
+def test_generation_follows_the_name_list():
+    catalog = Catalog()
+    catalog.reset(['a'])
+    generation = catalog.generation
+    catalog.update(listing(a='1'))
+    catalog.update(listing(a='2'))
+    assert catalog.generation == generation
+    catalog.update(listing(a='2', b='1'))
+    assert catalog.generation == generation + 1
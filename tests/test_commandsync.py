@@ -0,0 +1,51 @@
+import discord
+import pytest
+from discord import app_commands
+from unittest.mock import AsyncMock, MagicMock
+
+from cobot.blobstore import LocalBlobStore
+from cobot.commandsync import sync_if_changed, tree_fingerprint
+
+
+def make_tree(description='Play a sound'):
+    client = MagicMock()
+    client._connection._command_tree = None
+    tree = app_commands.CommandTree(client)
+
+    @app_commands.command(name='play', description=description)
+    async def play(interaction: discord.Interaction, sound_name: str):
+        pass
+
+    tree.add_command(play)
+    tree.sync = AsyncMock(return_value=['play'])
+    return tree
+
+
+def test_fingerprint_follows_definitions_and_scope():
+    base = tree_fingerprint(make_tree(), 1)
+    assert tree_fingerprint(make_tree(), 1) == base
+    assert tree_fingerprint(make_tree('Play it'), 1) != base
+    assert tree_fingerprint(make_tree(), 2) != base
+
+
+@pytest.mark.asyncio
+async def test_sync_only_when_changed(tmp_path):
+    store = LocalBlobStore(str(tmp_path / 'cache' / 'commands.sha256'))
+    tree = make_tree()
+    assert await sync_if_changed(tree, store, 1) == ['play']
+    assert await sync_if_changed(tree, store, 1) is None
+    tree.sync.assert_awaited_once()
+
+    changed = make_tree('Play it')
+    assert await sync_if_changed(changed, store, 1) == ['play']
+
+
+@pytest.mark.asyncio
+async def test_unreadable_store_still_syncs():
+    store = MagicMock()
+    store.load = AsyncMock(side_effect=OSError('nope'))
+    store.save = AsyncMock()
+    tree = make_tree()
+    assert await sync_if_changed(tree, store, 1) == ['play']
+    store.save.assert_awaited_once()
+
@@ -0,0 +1,96 @@
+import signal
+import sys
+
+from cobot import launcher
+from cobot.launcher import split_shards, worker_command
+
+
+def test_split_shards_covers_every_shard_once():
+    assignments = split_shards(10, 3)
+    assert assignments == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+    assert sorted(s for a in assignments for s in a) == list(range(10))
+
+
+def test_split_shards_never_starts_idle_workers():
+    assert split_shards(2, 8) == [[0], [1]]
+
+
+def test_worker_command_passes_bot_args_through():
+    cmd = worker_command([1, 3], 4, ['--mock-audio'])
+    assert cmd[:3] == [sys.executable, '-m', 'cobot.voice_bot']
+    assert cmd[3:] == ['--shard-count', '4', '--shard-ids', '1,3',
+                       '--mock-audio']
+
+
+def test_worker_command_adds_metrics_port():
+    cmd = worker_command([0], 1, [], metrics_port=9101)
+    assert cmd[-2:] == ['--metrics-port', '9101']
+
+
+class FakeProc:
+
+    def __init__(self, returncode):
+        self.returncode = returncode
+        self.pid = 1
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.returncode = -signum
+
+    def wait(self):
+        return self.returncode
+
+
+def test_dead_worker_is_restarted_after_delay(monkeypatch):
+    clock = [0.0]
+    handlers = {}
+    started = []
+
+    def popen(cmd):
+        # The first worker dies straight away, its replacement keeps running.
+        started.append(FakeProc(1 if not started else None))
+        return started[-1]
+
+    def sleep(seconds):
+        clock[0] += seconds
+        if len(started) == 2 or clock[0] > 60:
+            handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+    monkeypatch.setattr(sys, 'argv', ['launcher', '--workers', '1',
+                                      '--shard-count', '1',
+                                      '--restart-delay', '5'])
+    monkeypatch.setattr(launcher.subprocess, 'Popen', popen)
+    monkeypatch.setattr(launcher.signal, 'signal',
+                        lambda signum, handler: handlers.update({signum: handler}))
+    monkeypatch.setattr(launcher.time, 'sleep', sleep)
+    monkeypatch.setattr(launcher.time, 'monotonic', lambda: clock[0])
+
+    launcher.main()
+
+    assert len(started) == 2
+    assert 5 <= clock[0] <= 7
+
+
+def test_workers_get_their_own_metrics_port(monkeypatch):
+    handlers = {}
+    commands = []
+
+    def popen(cmd):
+        commands.append(cmd)
+        return FakeProc(None)
+
+    monkeypatch.setenv('COBOT_METRICS_PORT', '9100')
+    monkeypatch.setattr(sys, 'argv', ['launcher', '--workers', '3',
+                                      '--shard-count', '3'])
+    monkeypatch.setattr(launcher.subprocess, 'Popen', popen)
+    monkeypatch.setattr(launcher.signal, 'signal',
+                        lambda signum, handler: handlers.update({signum: handler}))
+    monkeypatch.setattr(launcher.time, 'sleep',
+                        lambda seconds: handlers[signal.SIGTERM](signal.SIGTERM, None))
+
+    launcher.main()
+
+    ports = [cmd[cmd.index('--metrics-port') + 1] for cmd in commands]
+    assert ports == ['9100', '9101', '9102']
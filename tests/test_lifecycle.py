@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from cobot.lifecycle import VoiceLifecycle
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_idle_after_timeout():
+    clock = Clock()
+    lifecycle = VoiceLifecycle(60, clock=clock)
+    lifecycle.touch(1)
+    lifecycle.touch(2)
+    clock.now = 30
+    lifecycle.touch(2)
+    clock.now = 61
+    assert lifecycle.idle_guilds() == [1]
+
+
+def test_busy_guilds_stay_active():
+    clock = Clock()
+    lifecycle = VoiceLifecycle(60, clock=clock)
+    lifecycle.touch(1)
+    clock.now = 100
+    assert lifecycle.idle_guilds(busy=lambda g: True) == []
+    clock.now = 150
+    assert lifecycle.idle_guilds() == []
+    clock.now = 160
+    assert lifecycle.idle_guilds() == [1]
+
+
+def test_track_keeps_existing_activity():
+    clock = Clock()
+    lifecycle = VoiceLifecycle(60, clock=clock)
+    lifecycle.touch(1)
+    clock.now = 50
+    lifecycle.track(1)
+    lifecycle.track(2)
+    clock.now = 61
+    assert lifecycle.idle_guilds() == [1]
+
+
+@pytest.mark.asyncio
+async def test_reap_releases_idle_guilds_once():
+    clock = Clock()
+    lifecycle = VoiceLifecycle(10, clock=clock)
+    lifecycle.touch(1)
+    clock.now = 11
+    released = []
+
+    async def release(guild_id):
+        released.append(guild_id)
+        if guild_id == 2:
+            raise RuntimeError('already gone')
+
+    lifecycle.touch(2)
+    clock.now = 30
+    task = asyncio.create_task(
+        lifecycle.reap(release, lambda g: False, interval=0.001))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert sorted(released) == [1, 2]
+    assert len(lifecycle) == 0
+
+
+@pytest.mark.asyncio
+async def test_reap_picks_up_connections_made_later():
+    clock = Clock()
+    lifecycle = VoiceLifecycle(10, clock=clock)
+    connected = []
+    released = []
+
+    async def release(guild_id):
+        released.append(guild_id)
+        connected.remove(guild_id)
+
+    task = asyncio.create_task(
+        lifecycle.reap(release, lambda g: False, interval=0.001,
+                       connected=lambda: connected))
+    await asyncio.sleep(0.005)
+    # Connected after the reaper started, without a touch().
+    connected.append(3)
+    await asyncio.sleep(0.005)
+    assert len(lifecycle) == 1
+    clock.now = 11
+    await asyncio.sleep(0.005)
+    task.cancel()
+    assert released == [3]
@@ -0,0 +1,63 @@
+import io
+import logging
+
+import pytest
+
+from cobot.logconfig import (LogfmtFormatter, RateLimitFilter, parse_levels,
+                             setup_logging)
+
+
+def record(level=logging.DEBUG, msg='hello', lineno=1):
+    return logging.LogRecord('sqcobot.test', level, 'voice_bot.py', lineno,
+                             msg, None, None)
+
+
+def test_parse_levels():
+    assert parse_levels('WARNING, sqcobot=debug,discord.gateway=ERROR') == {
+        '': 'WARNING',
+        'sqcobot': 'DEBUG',
+        'discord.gateway': 'ERROR',
+    }
+    with pytest.raises(ValueError):
+        parse_levels('sqcobot=LOUD')
+
+
+def test_rate_limit_per_call_site():
+    now = [0.0]
+    limiter = RateLimitFilter(rate=1, burst=2, clock=lambda: now[0])
+    assert [limiter.filter(record()) for _ in range(4)] == [
+        True, True, False, False]
+    # Other call sites and warnings are unaffected.
+    assert limiter.filter(record(lineno=2))
+    assert limiter.filter(record(logging.WARNING))
+
+    now[0] = 1.0
+    allowed = record()
+    assert limiter.filter(allowed)
+    assert allowed.dropped == 2
+
+
+def test_logfmt_is_one_line():
+    line = LogfmtFormatter().format(record(msg='say "hi"\nagain'))
+    assert '\n' not in line
+    assert 'level=DEBUG logger=sqcobot.test msg="say \\"hi\\"\\nagain"' in line
+
+
+def test_setup_logging_writes_from_listener_thread():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    before = list(root.handlers), root.level
+    listener = setup_logging(parse_levels('ERROR,sqcobot.test=INFO'),
+                             stream=stream)
+    try:
+        logging.getLogger('sqcobot.test').info('visible')
+        logging.getLogger('sqcobot.test').debug('hidden')
+        logging.getLogger('other').warning('below root level')
+    finally:
+        listener.stop()
+        root.handlers[:] = before[0]
+        root.setLevel(before[1])
+        logging.getLogger('sqcobot.test').setLevel(logging.NOTSET)
+    output = stream.getvalue()
+    assert 'msg="visible"' in output
+    assert 'hidden' not in output and 'below root level' not in output
@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+
+from cobot.loudness import LoudnessCache, file_digest, parse_loudnorm_output
+
+LOUDNORM_STDERR = """
+Input #0, ogg, from 'test.ogg':
+[Parsed_loudnorm_0 @ 0x55d0c8c0]
+{
+	"input_i" : "-23.54",
+	"input_tp" : "-5.12",
+	"input_lra" : "4.30",
+	"input_thresh" : "-34.01",
+	"output_i" : "-24.03",
+	"target_offset" : "0.03"
+}
+"""
+
+LOUDNESS = {
+    'input_i': '-23.54',
+    'input_tp': '-5.12',
+    'input_lra': '4.30',
+    'input_thresh': '-34.01',
+}
+
+
+def test_parse_loudnorm_output():
+    parsed = parse_loudnorm_output(LOUDNORM_STDERR)
+    assert parsed['input_i'] == '-23.54'
+    assert parsed['target_offset'] == '0.03'
+
+
+def test_file_digest_is_content_keyed(tmp_path):
+    a = tmp_path / 'a.ogg'
+    b = tmp_path / 'b.ogg'
+    a.write_bytes(b'same')
+    b.write_bytes(b'same')
+    assert file_digest(a) == file_digest(b)
+    b.write_bytes(b'different')
+    assert file_digest(a) != file_digest(b)
+
+
+@pytest.mark.asyncio
+async def test_measure_only_runs_once_per_content(tmp_path):
+    clip = tmp_path / 'clip.ogg'
+    clip.write_bytes(b'OggS')
+    cache = LoudnessCache(str(tmp_path / 'loudness.json'))
+    measure = AsyncMock(return_value=dict(LOUDNESS, output_i='-15'))
+
+    first = await cache.measure(str(clip), measure)
+    second = await cache.measure(str(clip), measure)
+
+    assert first == second == LOUDNESS
+    measure.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_cache_survives_reload(tmp_path):
+    path = str(tmp_path / 'cache' / 'loudness.json')
+    cache = LoudnessCache(path)
+    await cache.measure('unused', AsyncMock(return_value=LOUDNESS), key='etag')
+
+    reloaded = LoudnessCache(path)
+    reloaded.load()
+    assert reloaded.get('etag') == LOUDNESS
+
+
+def test_load_ignores_corrupt_file(tmp_path):
+    path = tmp_path / 'loudness.json'
+    path.write_text('{not json')
+    cache = LoudnessCache(str(path))
+    cache.load()
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_save_keeps_entries_from_other_processes(tmp_path):
+    path = str(tmp_path / 'loudness.json')
+    first = LoudnessCache(path)
+    second = LoudnessCache(path)
+    await first.measure('unused', AsyncMock(return_value=LOUDNESS), key='a')
+    await second.measure('unused', AsyncMock(return_value=LOUDNESS), key='b')
+
+    merged = LoudnessCache(path)
+    merged.load()
+    assert 'a' in merged and 'b' in merged
+
+
+@pytest.mark.asyncio
+async def test_concurrent_measurements_save_safely(tmp_path):
+    cache = LoudnessCache(str(tmp_path / 'loudness.json'))
+
+    async def measure(path):
+        await asyncio.sleep(0)
+        return LOUDNESS
+
+    await asyncio.gather(*(cache.measure('unused', measure, key=str(i))
+                           for i in range(200)))
+    reloaded = LoudnessCache(cache.path)
+    reloaded.load()
+    assert len(reloaded) == 200
@@ -0,0 +1,38 @@
+import tracemalloc
+
+from cobot.memory import (format_bytes, render_report, rss_bytes,
+                          subsystem_of, traced_by_subsystem)
+
+
+def test_subsystem_of():
+    assert subsystem_of('/app/cobot/autocomplete.py') == 'cobot.autocomplete'
+    assert subsystem_of(
+        '/venv/lib/python3.11/site-packages/discord/state.py') == 'discord'
+    assert subsystem_of('/venv/lib/python3.11/site-packages/six.py') == 'six'
+    assert subsystem_of('<frozen importlib._bootstrap>') == 'other'
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512B'
+    assert format_bytes(3 * 1024 * 1024) == '3MiB'
+
+
+def test_report_without_tracing():
+    assert not tracemalloc.is_tracing()
+    assert traced_by_subsystem() is None
+    report = render_report({'sounds': 42})
+    assert 'tracemalloc off' in report
+    assert 'sounds' in report and '42' in report
+    assert rss_bytes() is None or rss_bytes() > 0
+
+
+def test_report_with_tracing():
+    tracemalloc.start()
+    try:
+        keep = [bytearray(1024) for _ in range(100)]
+        traced = dict(traced_by_subsystem(limit=50))
+        assert sum(traced.values()) >= 100 * 1024
+        assert 'traced' in render_report({})
+        del keep
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,51 @@
+from unittest.mock import MagicMock
+
+from cobot.metrics import FirstPacketTimer, Histogram, Metrics
+
+
+def test_histogram_quantiles():
+    h = Histogram()
+    for ms in range(1, 101):
+        h.observe(ms / 1000)
+    q = h.quantiles()
+    assert q[0.5] == 0.051
+    assert q[0.99] == 0.1
+    assert h.count == 100
+
+
+def test_histogram_window_bounds_samples():
+    h = Histogram(window=10)
+    for i in range(100):
+        h.observe(i)
+    assert len(h.samples) == 10
+    assert h.count == 100
+
+
+def test_metrics_tracks_stages_per_guild_with_cap():
+    metrics = Metrics(max_guilds=2)
+    with metrics.span('download', guild=1):
+        pass
+    metrics.observe('download', 0.5, guild=2)
+    metrics.observe('download', 0.5, guild=3)
+    assert list(metrics.guilds) == [2, 3]
+    assert metrics.stages['download'].count == 3
+    assert 'download' in metrics.render_text(guild=3)
+
+
+def test_render_prometheus():
+    metrics = Metrics()
+    metrics.observe('analyze', 0.25, guild=7)
+    text = metrics.render_prometheus()
+    assert 'cobot_stage_seconds{stage="analyze",quantile="0.5"} 0.250000' in text
+    assert 'cobot_stage_seconds_count{stage="analyze",guild="7"} 1' in text
+
+
+def test_first_packet_timer_fires_once():
+    source = MagicMock()
+    source.read.return_value = b'frame'
+    callback = MagicMock()
+    timed = FirstPacketTimer(source, callback)
+    assert timed.read() == b'frame'
+    timed.read()
+    callback.assert_called_once()
+    assert timed.is_opus() == source.is_opus()
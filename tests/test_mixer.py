@@ -0,0 +1,49 @@
+import numpy as np
+from unittest.mock import MagicMock
+
+from cobot.mixer import SAMPLES_PER_FRAME, MixerSource
+
+
+def frames(source):
+    return [np.frombuffer(f, dtype='<i2') for f in iter(source.read, b'')]
+
+
+def test_mixer_sums_overlapping_streams():
+    mixer = MixerSource()
+    mixer.add(np.full(SAMPLES_PER_FRAME * 2, 100, dtype=np.int16))
+    mixer.add(np.full(SAMPLES_PER_FRAME, 50, dtype=np.int16))
+    out = frames(mixer)
+    assert len(out) == 2
+    assert (out[0] == 150).all()
+    assert (out[1] == 100).all()
+    assert not mixer.active
+
+
+def test_mixer_pads_short_tail_and_clips():
+    mixer = MixerSource()
+    mixer.add(np.full(10, 30000, dtype=np.int16))
+    mixer.add(np.full(10, 30000, dtype=np.int16))
+    (frame, ) = frames(mixer)
+    assert len(frame) == SAMPLES_PER_FRAME
+    assert (frame[:10] == 32767).all()
+    assert (frame[10:] == 0).all()
+
+
+def test_mixer_drops_oldest_stream_when_full():
+    mixer = MixerSource(max_streams=1)
+    mixer.add(np.full(SAMPLES_PER_FRAME, 1, dtype=np.int16))
+    mixer.add(np.full(SAMPLES_PER_FRAME, 2, dtype=np.int16))
+    (frame, ) = frames(mixer)
+    assert (frame == 2).all()
+
+
+def test_ensure_playing_only_starts_idle_client():
+    mixer = MixerSource()
+    vc = MagicMock()
+    vc.is_playing.return_value = True
+    mixer.ensure_playing(vc, MagicMock())
+    vc.play.assert_not_called()
+
+    vc.is_playing.return_value = False
+    mixer.ensure_playing(vc, MagicMock())
+    vc.play.assert_called_once()
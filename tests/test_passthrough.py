@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from cobot.passthrough import OggOpusAudio, OpusCache
+
+OPUS_CLIP = os.path.join(os.path.dirname(__file__), '..', 'sounds',
+                         'batman.ogg')
+
+
+def test_ogg_opus_audio_skips_headers():
+    source = OggOpusAudio(OPUS_CLIP)
+    assert source.is_opus()
+    packets = list(iter(source.read, b''))
+    assert packets
+    assert not any(p.startswith((b'OpusHead', b'OpusTags')) for p in packets)
+    assert source.read() == b''
+
+
+@pytest.mark.asyncio
+async def test_opus_cache_hit_skips_ffmpeg(tmp_path):
+    cache = OpusCache(str(tmp_path))
+    existing = tmp_path / os.path.basename(cache.path_for('abc', 'loudnorm'))
+    existing.write_bytes(b'OggS')
+    with patch('asyncio.create_subprocess_exec', new=AsyncMock()) as spawn:
+        path = await cache.get('clip.ogg', 'abc', 'loudnorm')
+    assert path == str(existing)
+    spawn.assert_not_awaited()
+
+
+def test_opus_cache_is_keyed_by_filter(tmp_path):
+    cache = OpusCache(str(tmp_path))
+    assert cache.path_for('abc', 'loudnorm=i=-15') != cache.path_for(
+        'abc', 'loudnorm=i=-16')
+
+
+def test_opus_cache_evicts_least_recently_played(tmp_path):
+    cache = OpusCache(str(tmp_path), max_bytes=250)
+    for age, name in enumerate(['new', 'old', 'oldest']):
+        path = tmp_path / f'{name}.opus'
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+    cache.evict(keep=str(tmp_path / 'oldest.opus'))
+    assert sorted(os.listdir(tmp_path)) == ['new.opus', 'oldest.opus']
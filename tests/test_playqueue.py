@@ -0,0 +1,160 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from cobot.playqueue import PlayQueue
+
+
+class FakeVoiceClient:
+
+    def __init__(self):
+        self.playing = None
+        self.after = None
+        self.played = []
+
+    def is_playing(self):
+        return self.playing is not None
+
+    def is_connected(self):
+        return True
+
+    def play(self, source, after=None):
+        self.playing, self.after = source, after
+        self.played.append(source)
+
+    def stop(self):
+        self.finish()
+
+    def finish(self):
+        after, self.playing, self.after = self.after, None, None
+        if after:
+            after(None)
+
+
+# Builds a MagicMock source per play, recording when each one is made.
+class Sources:
+
+    def __init__(self):
+        self.made = []
+
+    def __call__(self, name):
+
+        async def make_source():
+            source = MagicMock(name=name)
+            self.made.append(source)
+            return source
+
+        return make_source
+
+    def names(self, sources):
+        return [s._mock_name for s in sources]
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def queue(**kwargs):
+    return PlayQueue(asyncio.get_running_loop(), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_plays_in_order_and_bounds_waiting():
+    vc = FakeVoiceClient()
+    sources = Sources()
+    q = queue(policy='enqueue', max_size=2)
+    assert q.submit(vc, sources('a')) == 'playing'
+    assert q.submit(vc, sources('b')) == 'queued'
+    assert q.submit(vc, sources('c')) == 'queued'
+    assert q.submit(vc, sources('d')) == 'queued'
+    await settle()
+    # Waiting plays haven't built (or spawned) anything yet.
+    assert sources.names(sources.made) == ['a']
+
+    vc.finish()
+    await settle()
+    vc.finish()
+    await settle()
+    assert sources.names(vc.played) == ['a', 'c', 'd']
+    assert len(q) == 0
+
+
+@pytest.mark.asyncio
+async def test_preempt_cuts_off_current_sound():
+    vc = FakeVoiceClient()
+    sources = Sources()
+    q = queue(policy='preempt')
+    q.submit(vc, sources('a'))
+    await settle()
+    assert q.submit(vc, sources('b')) == 'playing'
+    await settle()
+    assert sources.names(vc.played) == ['a', 'b']
+    assert vc.playing is vc.played[-1]
+
+
+@pytest.mark.asyncio
+async def test_drop_refuses_while_playing():
+    vc = FakeVoiceClient()
+    sources = Sources()
+    q = queue(policy='drop')
+    q.submit(vc, sources('a'))
+    # Still counts as playing while its source is being built.
+    assert q.submit(vc, sources('b')) == 'dropped'
+    await settle()
+    assert sources.names(sources.made) == ['a']
+
+
+@pytest.mark.asyncio
+async def test_clear_drops_waiting_sounds():
+    vc = FakeVoiceClient()
+    sources = Sources()
+    q = queue()
+    q.submit(vc, sources('a'))
+    q.submit(vc, sources('b'))
+    await settle()
+    q.clear()
+    vc.finish()
+    await settle()
+    assert sources.names(vc.played) == ['a']
+
+
+@pytest.mark.asyncio
+async def test_slots_limit_playback_across_queues():
+    slots = asyncio.Semaphore(1)
+    first, second = FakeVoiceClient(), FakeVoiceClient()
+    sources = Sources()
+    queue(slots=slots).submit(first, sources('a'))
+    queue(slots=slots).submit(second, sources('b'))
+    await settle()
+    assert sources.names(sources.made) == ['a']
+
+    first.finish()
+    await settle()
+    assert sources.names(second.played) == ['b']
+
+
+@pytest.mark.asyncio
+async def test_failed_source_moves_on_and_frees_its_slot():
+    slots = asyncio.Semaphore(1)
+    vc = FakeVoiceClient()
+    sources = Sources()
+    q = queue(slots=slots)
+
+    async def broken():
+        raise RuntimeError('ffmpeg missing')
+
+    q.submit(vc, broken)
+    q.submit(vc, sources('b'))
+    await settle()
+    assert sources.names(vc.played) == ['b']
+    assert slots.locked()
+    vc.finish()
+    await settle()
+    assert not slots.locked()
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PlayQueue(MagicMock(), policy='shuffle')
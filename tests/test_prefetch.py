@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from cobot.prefetch import Prefetcher, likely_choices
+
+
+def test_likely_choices():
+    assert likely_choices([('a', 100), ('b', 40)]) == ['a', 'b']
+    many = [('a', 100), ('b', 95), ('c', 50), ('d', 40)]
+    assert likely_choices(many) == ['a', 'b']
+    crowded = [(k, 100) for k in 'abcd']
+    assert likely_choices(crowded) == []
+    assert likely_choices([('a', 0), ('b', 0)]) == []
+
+
+def test_hot_prefers_recent_then_frequent():
+    prefetcher = Prefetcher(None)
+    for name in ['a', 'a', 'a', 'b', 'c']:
+        prefetcher.record_play(name)
+    assert prefetcher.hot(2) == ['c', 'b']
+    assert prefetcher.hot(4) == ['c', 'b', 'a']
+
+
+@pytest.mark.asyncio
+async def test_request_warms_once_within_ttl():
+    warmed = []
+
+    async def warm(name):
+        warmed.append(name)
+
+    prefetcher = Prefetcher(warm)
+    prefetcher.request(['a', 'b'])
+    prefetcher.request(['a'])
+    await asyncio.gather(*prefetcher.pending.values())
+    prefetcher.request(['a'])
+    assert sorted(warmed) == ['a', 'b']
+    assert not prefetcher.pending
+
+
+@pytest.mark.asyncio
+async def test_newer_request_cancels_stale_guesses():
+    started = asyncio.Event()
+
+    async def warm(name):
+        started.set()
+        await asyncio.sleep(10)
+
+    prefetcher = Prefetcher(warm, concurrency=1)
+    prefetcher.request(['a'], group=1)
+    stale = prefetcher.pending[(1, 'a')]
+    await started.wait()
+    prefetcher.request(['b'], group=1)
+    await asyncio.sleep(0)
+    assert stale.cancelled()
+    assert (1, 'b') in prefetcher.pending
+    prefetcher.cancel_all()
+
+
+@pytest.mark.asyncio
+async def test_pending_is_bounded():
+    async def warm(name):
+        await asyncio.sleep(10)
+
+    prefetcher = Prefetcher(warm, max_pending=2)
+    prefetcher.request(['a', 'b', 'c'])
+    assert [n for _, n in prefetcher.pending] == ['b', 'c']
+    prefetcher.cancel_all()
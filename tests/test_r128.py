@@ -0,0 +1,78 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from cobot import r128
+from cobot.loudness import LOUDNESS_FIELDS
+
+
+def sine(seconds, dbfs, freq=1000):
+    t = np.arange(int(seconds * r128.RATE)) / r128.RATE
+    s = 10**(dbfs / 20) * np.sin(2 * np.pi * freq * t)
+    return np.stack([s, s], axis=1)
+
+
+def test_stereo_sine_matches_reference_level():
+    # BS.1770: a 1kHz tone at -20dBFS in both channels reads -20 LUFS.
+    loudness = r128.analyze(sine(5, -20))
+    assert set(loudness) == set(LOUDNESS_FIELDS)
+    assert float(loudness['input_i']) == pytest.approx(-20.0, abs=0.1)
+    assert float(loudness['input_tp']) == pytest.approx(-20.0, abs=0.1)
+    assert float(loudness['input_thresh']) == pytest.approx(-30.0, abs=0.1)
+    assert loudness['input_lra'] == '0.00'
+
+
+def test_loudness_range_of_level_step():
+    pcm = np.concatenate([sine(5, -20), sine(5, -30)])
+    loudness = r128.analyze(pcm)
+    assert float(loudness['input_lra']) == pytest.approx(10.0, abs=0.5)
+
+
+def test_true_peak_sees_intersample_overs():
+    # fs/4 tone sampled 45 degrees off its peaks: samples read -3dB but the
+    # reconstructed waveform reaches full scale.
+    n = np.arange(r128.RATE)
+    s = np.sin(np.pi / 2 * n + np.pi / 4)
+    pcm = np.stack([s, s], axis=1)
+    assert np.abs(pcm).max() == pytest.approx(10**(-3.01 / 20), abs=1e-3)
+    assert float(r128.analyze(pcm)['input_tp']) == pytest.approx(0.0, abs=0.1)
+
+
+def test_silence_is_clamped_to_loudnorm_range():
+    assert r128.analyze(np.zeros((r128.RATE, 2))) == {
+        'input_i': '-99.00',
+        'input_tp': '-99.00',
+        'input_lra': '0.00',
+        'input_thresh': '-99.00',
+    }
+
+
+def test_long_clip_is_analyzed_in_bounded_memory():
+    # Two minutes of decoded stereo is 46MB by itself; the analysis must not
+    # need copies of it.
+    pcm = np.random.default_rng(0).uniform(
+        -0.1, 0.1, (120 * r128.RATE, 2)).astype(np.float32)
+    tracemalloc.start()
+    try:
+        r128.analyze(pcm)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 * 1024 * 1024
+
+
+def test_analyze_batch():
+    quiet, loud = r128.analyze_batch([sine(1, -30), sine(1, -10)])
+    assert float(quiet['input_i']) < float(loud['input_i'])
+
+
+@pytest.mark.asyncio
+async def test_measure_decodes_once_and_analyzes():
+    pcm = sine(1, -20).astype('<f4')
+    decode = AsyncMock(return_value=r128.pcm_from_bytes(pcm.tobytes()))
+    with patch('cobot.r128.decode_file', decode):
+        loudness = await r128.measure('clip.ogg')
+    decode.assert_awaited_once_with('clip.ogg')
+    assert float(loudness['input_i']) == pytest.approx(-20.0, abs=0.1)
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from cobot.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    calls = []
+    gate = asyncio.Event()
+
+    async def fetch(name):
+        calls.append(name)
+        await gate.wait()
+        return f"{name}.ogg"
+
+    waiters = [asyncio.create_task(flights.run('a', fetch, 'a'))
+               for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.set()
+    assert await asyncio.gather(*waiters) == ['a.ogg'] * 3
+    assert calls == ['a']
+    assert len(flights) == 0
+
+    assert await flights.run('a', fetch, 'a') == 'a.ogg'
+    assert calls == ['a', 'a']
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError('boom')
+
+    results = await asyncio.gather(flights.run('x', fail),
+                                   flights.run('x', fail),
+                                   return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_flight_running():
+    flights = SingleFlight()
+    gate = asyncio.Event()
+
+    async def fetch():
+        await gate.wait()
+        return 'done'
+
+    first = asyncio.create_task(flights.run('a', fetch))
+    second = asyncio.create_task(flights.run('a', fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    gate.set()
+    assert await second == 'done'
+
+
+@pytest.mark.asyncio
+async def test_last_cancelled_waiter_cancels_the_flight():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    cancelled = []
+
+    async def fetch():
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    first = asyncio.create_task(flights.run('a', fetch))
+    second = asyncio.create_task(flights.run('a', fetch))
+    await started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    assert not cancelled
+    second.cancel()
+    await asyncio.gather(first, second, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert cancelled == [True]
+    assert len(flights) == 0
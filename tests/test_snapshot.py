@@ -0,0 +1,21 @@
+import json
+import time
+
+from cobot.snapshot import SNAPSHOT_VERSION, dump_snapshot, parse_snapshot
+
+
+def test_dump_and_parse():
+    state = parse_snapshot(dump_snapshot({'voice': [[1, 2]]}), max_age=60)
+    assert state['voice'] == [[1, 2]]
+    assert state['version'] == SNAPSHOT_VERSION
+
+
+def test_stale_or_foreign_snapshots_are_ignored():
+    old = json.dumps({'version': SNAPSHOT_VERSION,
+                      'created': time.time() - 120})
+    assert parse_snapshot(old, max_age=60) is None
+    other = json.dumps({'version': SNAPSHOT_VERSION + 1,
+                        'created': time.time()})
+    assert parse_snapshot(other, max_age=60) is None
+    assert parse_snapshot(b'not json', max_age=60) is None
+
@@ -1,17 +1,18 @@
-import os
+import asyncio
+import subprocess
+import sys
+from unittest.mock import AsyncMock, MagicMock
 
-os.environ.setdefault("AUDIO_BUCKET", "test-bucket")
+import pytest
+import discord
+from discord.ext import commands
 
-from unittest.mock import patch, MagicMock
-
-# Patch boto3.client before importing code that uses it
-with patch("boto3.client", return_value=MagicMock()):
-    import pytest
-    import discord
-    from discord.ext import commands
-    from unittest.mock import AsyncMock
-
-    import cobot.voice_bot as voice_bot
+import cobot.voice_bot as voice_bot
+from cobot.autocomplete import SoundIndex
+from cobot.browser import PageCache
+from cobot.catalog import Catalog
+from cobot.metrics import Metrics
+from cobot.singleflight import SingleFlight
 
 
 @pytest.fixture
@@ -21,6 +22,37 @@ def bot():
     return bot
 
 
+# Fresh module state for one test, all of it put back afterwards.
+@pytest.fixture
+def module_state(monkeypatch):
+    for name in ('args', 'bot', 's3_bucket', 'audio_source', 'loudness_cache',
+                 'opus_cache', 'prefetcher', 'ffmpeg_slots', 'playback_slots',
+                 'lifecycle'):
+        monkeypatch.setattr(voice_bot, name, None)
+    monkeypatch.setattr(voice_bot, 'commands_synced', False)
+    monkeypatch.setattr(voice_bot, 'restored_voice', [])
+    monkeypatch.setattr(voice_bot, 'sounds', {})
+    monkeypatch.setattr(voice_bot, 'sound_index', SoundIndex())
+    monkeypatch.setattr(voice_bot, 'catalog', Catalog())
+    monkeypatch.setattr(voice_bot, 'background_tasks', set())
+    monkeypatch.setattr(voice_bot, 'mixers', {})
+    monkeypatch.setattr(voice_bot, 'play_queues', {})
+    monkeypatch.setattr(voice_bot, 'flights', SingleFlight())
+    monkeypatch.setattr(voice_bot, 'metrics', Metrics())
+    monkeypatch.setattr(voice_bot, 'list_pages', PageCache())
+
+
+# voice_bot.init() with local audio and a throwaway cache directory.
+@pytest.fixture
+def init_bot(module_state, tmp_path):
+
+    def init(*argv):
+        return voice_bot.init(['--mock-audio', '--cache-dir',
+                               str(tmp_path / 'cache'), *argv])
+
+    return init
+
+
 @pytest.mark.asyncio
 async def test_depunctuate():
     assert voice_bot.depunctuate('Test-Name_123!') == 'testname123'
@@ -77,3 +109,335 @@ async def test_join_voice_channel_connect(monkeypatch):
     channel.connect = AsyncMock()
     await voice_bot.join_voice_channel(interaction, channel)
     channel.connect.assert_awaited()
+
+
+def test_import_has_no_side_effects():
+    assert voice_bot.bot is None
+    assert voice_bot.args is None
+    # Fresh interpreter, since other tests may have imported boto3 already.
+    subprocess.run([
+        sys.executable, '-c', 'import sys, cobot.voice_bot; '
+        'assert "boto3" not in sys.modules and "numpy" not in sys.modules'
+    ], check=True)
+
+
+def test_init_builds_bot_with_commands(init_bot):
+    bot = init_bot()
+    names = {c.name for c in bot.tree.get_commands()}
+    assert {'play', 'list', 'join', 'summon', 'leave', 'stop'} <= names
+
+
+@pytest.mark.asyncio
+async def test_cached_catalog_roundtrip(tmp_path, module_state):
+    voice_bot.args = voice_bot.parse_args(['--cache-dir', str(tmp_path)])
+    voice_bot.save_cached_catalog(['Hello-World'])
+    voice_bot.load_cached_catalog()
+    assert voice_bot.sounds == {'helloworld': 'Hello-World'}
+
+
+@pytest.mark.asyncio
+async def test_refresh_catalog_applies_diff(tmp_path, init_bot):
+    sound_dir = tmp_path / 'sounds'
+    sound_dir.mkdir()
+    for name in ('Alpha', 'Bravo'):
+        (sound_dir / f'{name}.ogg').write_bytes(b'ogg')
+    init_bot('--audio-dir', str(sound_dir))
+    await voice_bot.load_catalog()
+    assert set(voice_bot.sounds) == {'alpha', 'bravo'}
+
+    (sound_dir / 'Bravo.ogg').unlink()
+    (sound_dir / 'Charlie-1.ogg').write_bytes(b'ogg')
+    await voice_bot.refresh_catalog()
+    assert voice_bot.sounds == {'alpha': 'Alpha', 'charlie1': 'Charlie-1'}
+    assert voice_bot.sound_index.top('charlie', 1) == ['charlie1']
+
+
+@pytest.mark.asyncio
+async def test_list_sends_one_ephemeral_browser(module_state):
+    voice_bot.set_catalog(['Bravo', 'Alpha', 'Batman-Theme'])
+    interaction = MagicMock()
+    interaction.response.send_message = AsyncMock()
+    await voice_bot.list_sounds.callback(interaction)
+    args, kwargs = interaction.response.send_message.call_args
+    assert args[0].startswith("```\nAlpha\nBatman-Theme\nBravo\n```")
+    assert kwargs['ephemeral'] is True
+    assert isinstance(kwargs['view'], voice_bot.SoundBrowser)
+    assert voice_bot.search_sounds('batman') == ['Batman-Theme']
+
+
+@pytest.mark.asyncio
+async def test_concurrent_prepares_share_one_analysis(tmp_path, init_bot,
+                                                      monkeypatch):
+    sound_dir = tmp_path / 'sounds'
+    sound_dir.mkdir()
+    (sound_dir / 'Alpha.ogg').write_bytes(b'ogg')
+    init_bot('--audio-dir', str(sound_dir))
+    get_volume = AsyncMock(return_value={
+        'input_i': '-20', 'input_tp': '-1', 'input_lra': '1',
+        'input_thresh': '-30'})
+    monkeypatch.setattr(voice_bot, 'get_volume', get_volume)
+    first, second = await asyncio.gather(
+        voice_bot.prepare_sound('Alpha'), voice_bot.prepare_sound('Alpha'))
+    assert first == second
+    get_volume.assert_awaited_once()
+
+
+def play_interaction(vc=None):
+    interaction = MagicMock()
+    interaction.user = MagicMock(spec=discord.Member)
+    interaction.guild.voice_client = vc
+    interaction.response.defer = AsyncMock()
+    interaction.response.send_message = AsyncMock()
+    interaction.response.is_done.return_value = True
+    interaction.followup.send = AsyncMock()
+    return interaction
+
+
+@pytest.mark.asyncio
+async def test_play_connects_while_preparing(init_bot, monkeypatch):
+    init_bot()
+    voice_bot.set_catalog(['Alpha'])
+    events = []
+
+    async def prepare_sound(name):
+        events.append('prepare start')
+        await asyncio.sleep(0.05)
+        events.append('prepare end')
+        return 'Alpha.ogg', 'digest', 'loudnorm'
+
+    vc = MagicMock(spec=discord.VoiceClient)
+    vc.is_playing.return_value = False
+
+    async def connect():
+        events.append('connect start')
+        await asyncio.sleep(0.05)
+        events.append('connect end')
+        return vc
+
+    monkeypatch.setattr(voice_bot, 'prepare_sound', prepare_sound)
+    monkeypatch.setattr(voice_bot, 'make_audio_source',
+                        AsyncMock(return_value=MagicMock()))
+    interaction = play_interaction()
+    interaction.user.voice.channel.connect = connect
+
+    await voice_bot.play.callback(interaction, 'Alpha')
+    await asyncio.sleep(0)
+
+    assert events[:2] == ['prepare start', 'connect start']
+    vc.play.assert_called_once()
+    interaction.followup.send.assert_awaited_once_with('Playing `Alpha`.',
+                                                       ephemeral=True)
+
+
+@pytest.mark.asyncio
+async def test_play_reports_connect_failure(init_bot, monkeypatch):
+    init_bot()
+    voice_bot.set_catalog(['Alpha'])
+    prepared = asyncio.Event()
+
+    async def prepare_sound(name):
+        await prepared.wait()
+
+    monkeypatch.setattr(voice_bot, 'prepare_sound', prepare_sound)
+    interaction = play_interaction()
+    interaction.user.voice.channel.connect = AsyncMock(
+        side_effect=discord.ClientException('no permission'))
+
+    await voice_bot.play.callback(interaction, 'Alpha')
+
+    interaction.followup.send.assert_awaited_once_with(
+        'Error: no permission', ephemeral=True)
+    assert not voice_bot.flights.flights
+
+
+
+@pytest.mark.asyncio
+async def test_source_start_times_building_the_source(init_bot, monkeypatch):
+    init_bot()
+    voice_bot.set_catalog(['Alpha'])
+    vc = MagicMock(spec=discord.VoiceClient)
+    vc.is_playing.return_value = False
+    vc.channel = MagicMock()
+    built = asyncio.Event()
+
+    async def make_audio_source(*args):
+        await asyncio.sleep(0.05)
+        built.set()
+        return MagicMock()
+
+    monkeypatch.setattr(voice_bot, 'prepare_sound',
+                        AsyncMock(return_value=('Alpha.ogg', 'digest', None)))
+    monkeypatch.setattr(voice_bot, 'make_audio_source', make_audio_source)
+    interaction = play_interaction(vc)
+    interaction.user.voice.channel = vc.channel
+
+    await voice_bot.play.callback(interaction, 'Alpha')
+    await built.wait()
+
+    source_start = voice_bot.metrics.stages['source_start']
+    assert source_start.count == 1
+    assert source_start.quantiles()[0.5] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_stop_cancels_a_play_that_is_still_starting(init_bot):
+    init_bot('--playback', 'pcm', '--playback-jobs', '1')
+    vc = MagicMock(spec=discord.VoiceClient)
+    vc.is_playing.return_value = False
+    interaction = play_interaction(vc)
+    queue = voice_bot.play_queue(interaction.guild.id)
+    await voice_bot.playback_slots.acquire()
+    queue.submit(vc, AsyncMock())
+
+    await voice_bot.stop.callback(interaction)
+    voice_bot.playback_slots.release()
+    await asyncio.sleep(0)
+
+    interaction.response.send_message.assert_awaited_once_with(
+        "Stopped playing sound.", ephemeral=True)
+    assert not queue.busy(vc)
+    vc.play.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_play_moves_to_the_users_channel(init_bot, monkeypatch):
+    init_bot()
+    voice_bot.set_catalog(['Alpha'])
+    vc = MagicMock(spec=discord.VoiceClient)
+    vc.is_playing.return_value = False
+    vc.channel = MagicMock()
+    vc.move_to = AsyncMock()
+    monkeypatch.setattr(voice_bot, 'prepare_sound',
+                        AsyncMock(return_value=('Alpha.ogg', 'digest', None)))
+    monkeypatch.setattr(voice_bot, 'make_audio_source',
+                        AsyncMock(return_value=MagicMock()))
+    interaction = play_interaction(vc)
+
+    await voice_bot.play.callback(interaction, 'Alpha')
+    await asyncio.sleep(0)
+
+    vc.move_to.assert_awaited_once_with(interaction.user.voice.channel)
+    vc.play.assert_called_once()
+
+def test_low_memory_trims_intents_and_caches(init_bot):
+    bot = init_bot('--low-memory')
+    assert not bot.intents.message_content
+    assert not bot.intents.messages
+    assert bot.intents.guilds and bot.intents.voice_states
+    assert bot._connection.max_messages is None
+    assert not bot._connection.member_cache_flags.joined
+    assert 'memory' in {c.name for c in bot.tree.get_commands()}
+    assert voice_bot.cache_counts()['cached messages'] == 0
+    assert voice_bot.sound_index.cache_size == 64
+
+
+
+@pytest.mark.parametrize('value,enabled', [('1', True), ('true', True),
+                                           ('Yes', True), ('0', False),
+                                           ('false', False), ('', False)])
+def test_low_memory_env_flag(monkeypatch, value, enabled):
+    monkeypatch.setenv('COBOT_LOW_MEMORY', value)
+    monkeypatch.setenv('COBOT_TRACEMALLOC', value)
+    args = voice_bot.parse_args([])
+    assert args.low_memory is enabled
+    assert args.tracemalloc is enabled
+
+@pytest.mark.asyncio
+async def test_idle_guild_is_released(init_bot, monkeypatch):
+    init_bot()
+    guild = MagicMock()
+    guild.voice_client.disconnect = AsyncMock()
+    monkeypatch.setattr(voice_bot.bot, 'get_guild', lambda gid: guild)
+    voice_bot.play_queues[7] = MagicMock()
+    voice_bot.lifecycle.touch(7)
+
+    await voice_bot.release_idle_guild(7)
+
+    guild.voice_client.disconnect.assert_awaited_once()
+    assert 7 not in voice_bot.play_queues
+    assert len(voice_bot.lifecycle) == 0
+
+
+def test_guild_starting_a_play_is_busy(init_bot, monkeypatch):
+    init_bot()
+    guild = MagicMock()
+    guild.voice_client.is_playing.return_value = False
+    monkeypatch.setattr(voice_bot.bot, 'get_guild', lambda gid: guild)
+    voice_bot.play_queues[7] = MagicMock(starting=None)
+    assert not voice_bot.guild_busy(7)
+
+    voice_bot.play_queues[7].starting = MagicMock()
+    assert voice_bot.guild_busy(7)
+
+@pytest.mark.asyncio
+async def test_on_ready_syncs_once_and_skips_unchanged_tree(init_bot,
+                                                            monkeypatch):
+    bot = init_bot()
+    monkeypatch.setattr(bot, '_connection', MagicMock(application_id=1))
+    sync = AsyncMock(return_value=[])
+    monkeypatch.setattr(bot.tree, 'sync', sync)
+
+    await voice_bot.on_ready()
+    await voice_bot.on_ready()
+    assert sync.await_count == 1
+
+    # A restart with the same commands doesn't sync again.
+    voice_bot.commands_synced = False
+    await voice_bot.on_ready()
+    assert sync.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restores_catalog_and_voice(init_bot, monkeypatch):
+    bot = init_bot('--no-prefetch')
+    voice_bot.set_catalog(['Alpha'], {'Alpha': ('etag', '2024')})
+    voice_bot.loudness_cache.put('digest', {
+        'input_i': '-20', 'input_tp': '-1', 'input_lra': '3',
+        'input_thresh': '-30'})
+    voice_bot.prefetcher.record_play('Alpha')
+    vc = MagicMock()
+    vc.guild.id, vc.channel.id = 7, 70
+    monkeypatch.setattr(type(bot), 'voice_clients',
+                        property(lambda self: [vc]))
+    monkeypatch.setattr(bot, 'close', AsyncMock())
+    await voice_bot.shutdown()
+    bot.close.assert_awaited_once()
+
+    voice_bot.set_catalog([])
+    init_bot('--no-prefetch')
+    assert await voice_bot.load_snapshot()
+    assert voice_bot.sounds == {'alpha': 'Alpha'}
+    assert voice_bot.catalog.versions == {'Alpha': ('etag', '2024')}
+    assert 'digest' in voice_bot.loudness_cache
+    assert voice_bot.prefetcher.hot(1) == ['Alpha']
+    assert voice_bot.restored_voice == [[7, 70]]
+
+
+def test_main_sets_up_logging_before_init(module_state, tmp_path,
+                                          monkeypatch):
+    calls = []
+    monkeypatch.setenv('DISCORD_TOKEN', 'token')
+    monkeypatch.setattr(voice_bot, 'setup_logging',
+                        lambda *a, **kw: calls.append('logging'))
+    init = voice_bot.init
+
+    def init_and_record(argv=None, options=None):
+        # main() hands over what it parsed instead of parsing argv again.
+        assert argv is None and options.mock_audio
+        calls.append('init')
+        bot = init(argv, options)
+        monkeypatch.setattr(bot, 'run', lambda *a, **kw: calls.append('run'))
+        return bot
+
+    monkeypatch.setattr(voice_bot, 'init', init_and_record)
+    voice_bot.main(['--mock-audio', '--cache-dir', str(tmp_path)])
+    assert calls == ['logging', 'init', 'run']
+
+
+def test_bucket_stores_share_one_s3_source(init_bot, monkeypatch):
+    monkeypatch.setenv('AUDIO_BUCKET', 'bucket')
+    init_bot('--snapshot-store', 'bucket', '--command-sync-store', 'bucket')
+    voice_bot.args.mock_audio = False
+    source = voice_bot.snapshot_store().s3_source
+    assert voice_bot.snapshot_store().s3_source is source
+    assert voice_bot.fingerprint_store().s3_source is source